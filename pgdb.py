@@ -49,6 +49,8 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #   $ python pgdb_x86.py -nasmlst myasmcode.lst -objdump myccode.lst ...
 #   (args are read left to right so shell wildcards work)
 #   $ python pgdb_x86.py -nasmlst src/{a,b,c}.lst -gccmap mapfiles/*.map
+#   or let pgdb start qemu itself and talk to its gdbstub over stdio:
+#   $ python pgdb.py -remote 'stdio:qemu-system-i386 -gdb stdio -S ...' ...
 #
 # ncurses issues:
 #   - TERM=rxvt-unicode-265color is the default for urxvt but the term info
@@ -288,11 +290,10 @@ Help_text_main = \
 """      h - toggles visibility of context sensitive help
        l - toggles visibility of the log window
      tab - rotates the active window
-       r - reorder windows (useful after resize)
+       r - reorder windows, rereads the cpu list
  <enter> - refresh window, if cpu make it active
 <number> - select source window (twice to pin)(sh+N 11-20)
-       / - text search source window (prompts for text)
-       n - next text search
+     / n - text search source window (prompts) / next match
      b/w - set a breakpoint/watchpoint (prompts for addr)
        v - clear all breakpoints and watchpoints
        m - new memory window (prompts for address)
@@ -300,7 +301,8 @@ Help_text_main = \
        a - lookup a hex address in current source window
      s/S - single step active cpu / all cpus
      j/J - jump active cpu / all cpus to highlight addr
-     c/C - continue active cpu / all cpus
+   c/C i - continue active cpu / all cpus, i interrupts
+     t/T - toggle rdp stats window / save stats to pgdb.stats
      q/Q - quit pgdb / and kill qemu also
     ctrl+arrows - move active window around screen
      ctrl+space - raise active window to the top
@@ -339,9 +341,19 @@ import sys
 import string
 import curses
 import curses.panel
-import socket
-import asyncore
+import tty
+import time
+import shlex
+import asyncio
+import binascii
 import traceback
+import hashlib
+import json
+import mmap
+import array
+import bisect
+import math
+import collections
 import importlib
 
 
@@ -369,12 +381,38 @@ Arch_name = 'x86'           # neither qemu-i386 or qemu-x86_64 offer any .xml
                             # put your fav default here!
 
 Host_port = ('0.0.0.0', 1234)
+Remote_medium = 'tcp'       # tcp, unix, pty or stdio (-remote)
+Remote_path = None          # unix socket or pty path, or stdio command line
+Record_file = None          # save the rdp session to this file (-record)
+Replay_file = None          # play a recorded session back (-replay)
+Pipeline_depth = 4          # max rdp commands in flight (-pipeline N)
+Rbuf_size = 0x10000         # initial rdp receive buffer size, grows as needed
+Rbuf_min_free = 0x1000      # grow the receive buffer when less is free
+Packet_size = 0x400         # assumed stub PacketSize if qSupported doesn't say
+Regs_refresh_delay = 0.25   # secs after a stop before refetching every cpu
+Stats_steps = 8             # latency histogram buckets per doubling
+Stats_refresh_delay = 0.25  # secs between rdp stats panel redraws
+Mem_page_size = 0x100       # granularity of the target memory cache
+Stats_file = 'pgdb.stats'   # where 'T' saves the rdp stats
+Replay_key_delay = 0.01     # secs between replayed traffic and the next key
+Key_poll_interval = 0.1     # secs between getch() polls, for KEY_RESIZE
+Reg_fetch = 'g'             # 'g' reads all regs, 'p' only displayed ones (-regfetch)
+Mmap_listings = False       # keep listings mmapped, not in memory (-mmap)
+Tdesc_cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                               os.path.expanduser('~/.cache')), 'pgdb')
+Tdesc_version = 2           # bump when the cached target description changes
 
 # ----------------------------------------------------------------------------
 # early command line processing
 
 if '-h' in sys.argv or '--help' in sys.argv:
-    print('usage: python pgdb.py [-remote tcp::1234] [-nasmlst <file1>] [-objdump <file2>] ...')
+    print('usage: python pgdb.py [-remote tcp::1234] [-pipeline 4] [-nasmlst <file1>] [-objdump <file2>] ...')
+    print('       -remote is one of tcp:host:port, unix:path, pty:/dev/pts/N or')
+    print('       \'stdio:qemu-system-xxx -gdb stdio ...\' (pgdb starts qemu)')
+    print('       [-record <session>] saves all rdp traffic and keys to a file')
+    print('       [-replay <session>] plays one back instead of connecting')
+    print('       [-regfetch p] reads only the displayed registers, with \'p\' packets')
+    print('       [-mmap] leaves listings in their (mmapped) files instead of in memory')
     print()
     print(Help_text_main)
     print()
@@ -389,11 +427,18 @@ if '-remote' in sys.argv:
     remote = ''
     try:
         remote = sys.argv.pop(idx)
-        medium, host, port = remote.split(':')
-        if medium != 'tcp': raise Exception('only tcp supported so far')
-        if len(host) == 0: host = '0.0.0.0'
-        port = int(port)
-        Host_port = (host, port)
+        medium, path = remote.split(':', 1)
+        if medium == 'tcp':
+            host, port = path.split(':')
+            if len(host) == 0: host = '0.0.0.0'
+            port = int(port)
+            Host_port = (host, port)
+        elif medium in ['unix', 'pty', 'stdio']:
+            if len(path) == 0: raise Exception('missing %s path' % medium)
+            Remote_path = path
+        else:
+            raise Exception('use tcp:host:port, unix:path, pty:path or stdio:cmd')
+        Remote_medium = medium
     except:
         print('bad -remote arg [%s]: %s' % (remote, sys.exc_info()[1]))
         sys.exit(0)
@@ -403,6 +448,37 @@ if '-arch' in sys.argv:
     sys.argv.pop(idx)
     Arch_name = sys.argv.pop(idx)
 
+if '-pipeline' in sys.argv:
+    idx = sys.argv.index('-pipeline')
+    sys.argv.pop(idx)
+    try:
+        Pipeline_depth = max(1, int(sys.argv.pop(idx)))
+    except:
+        print('bad -pipeline arg: %s' % sys.exc_info()[1])
+        sys.exit(0)
+
+if '-regfetch' in sys.argv:
+    idx = sys.argv.index('-regfetch')
+    sys.argv.pop(idx)
+    Reg_fetch = sys.argv.pop(idx) if idx < len(sys.argv) else ''
+    if not Reg_fetch in ['g', 'p']:
+        print('bad -regfetch arg [%s]: use g or p' % Reg_fetch)
+        sys.exit(0)
+
+if '-mmap' in sys.argv:
+    sys.argv.remove('-mmap')
+    Mmap_listings = True
+
+if '-record' in sys.argv:
+    idx = sys.argv.index('-record')
+    sys.argv.pop(idx)
+    Record_file = sys.argv.pop(idx)
+
+if '-replay' in sys.argv:
+    idx = sys.argv.index('-replay')
+    sys.argv.pop(idx)
+    Replay_file = sys.argv.pop(idx)
+
 def load_arch_module():
     # don't call this before the Log window has been defined.
     global Arch
@@ -417,6 +493,10 @@ def load_arch_module():
         Arch.Log = Log
         Arch.DSfns = DSfns
         Arch.CPerr = CPerr
+        Gspec_layouts.clear()
+        # compile the data structure decoders once, up front
+        for spec in getattr(Arch, 'data_structs', []):
+            spec.code = ds_compile(spec)
     except:
         Log.write('unable to load %s\n' % fn, CPerr)
         Log.write('try:  python %s  alone to check for errors\n' % fn, CPerr)
@@ -438,6 +518,7 @@ class FakeArch(object):
 # gdb client support
 
 Gdbc = None
+Session = None          # the SessionRecorder when -record is used
 Breakpoints = {}        # a list of active 'Z0,xxxx,1' breakpoint commands
 Watchpoints = {}        # a list of active 'Z2,xxxx,n' watchpoint commands
 
@@ -449,27 +530,80 @@ def lsn2msn(s):
         rval += s[i-2:i]
     return rval
 
-def dumpmem(s, addr, wth=16):
-    # addr is an integer
+# compiled 'g' reply layouts, keyed by (reply length, gspec length).
+# cleared whenever the Arch module or its gspecs change.
+Gspec_layouts = {}
+
+def gspec_layout(spec_len):
+    # compile the Arch gspec for a 'g' reply of spec_len hex digits into
+    # (name, first byte, end byte) offsets into the unhexlify'd reply.
+    # None if some register doesn't sit on a byte boundary.
+    gspec = Arch.spec[spec_len]['gspec']
+    key = (spec_len, len(gspec))
+    if key in Gspec_layouts:
+        return Gspec_layouts[key]
+    layout = []
+    for name, start, end in gspec:
+        if end > spec_len:
+            continue
+        if start % 2  or  end % 2:
+            layout = None
+            break
+        layout.append((name, start // 2, end // 2))
+    Gspec_layouts[key] = layout
+    return layout
+
+def gspec_decode(rbuf, spec_len):
+    # decode a whole 'g' reply into a {regname: value} dict
+    layout = gspec_layout(spec_len)
+    if layout != None:
+        try:
+            data = binascii.unhexlify(rbuf)
+        except binascii.Error:
+            layout = None       # eg. 'xx' for unavailable registers
+    if layout != None:
+        frombytes = int.from_bytes
+        return {name: frombytes(data[a:b], 'little') for name, a, b in layout}
+    # the slow way, a nibble string at a time
+    newregs = {}
+    for spec in Arch.spec[spec_len]['gspec']:
+        if spec[2] <= spec_len:
+            try:
+                newregs[spec[0]] = int(lsn2msn(rbuf[spec[1]:spec[2]]), 16)
+            except ValueError:
+                pass
+    return newregs
+
+# gdb register numbers from the target description, {name: regnum}
+Tdesc_regnums = {}
+
+def gspec_regnums(gspec):
+    # {name: gdb register number} for the registers of a gspec.  the
+    # target description numbers them when there is one.  otherwise gdb
+    # numbers registers in 'g' reply order (gspecs are in display order),
+    # and numbering stops at the first gap, past that they are unknown.
+    nums = dict((spec[0], Tdesc_regnums[spec[0]])
+                for spec in gspec if spec[0] in Tdesc_regnums)
+    if len(nums) > 0:
+        return nums
+    idx = 0
+    for spec in sorted(gspec, key=lambda spec: spec[1]):
+        if spec[1] != idx:
+            break
+        nums[spec[0]] = len(nums)
+        idx = spec[2]
+    return nums
+
+# bytes.translate() table for the character column of memory dumps
+Printable = bytes([c if c >= 32 and c < 127 else ord('.') for c in range(256)])
+
+def dumpmem(data, addr, wth=16):
+    # data is bytes, addr is an integer
     rval = []
-
-    def prntabl(c):
-        return chr(c) if c >= 32 and c < 127 else '.'
-
-    def bytegen(s, n):
-        # yield 'n' formatted hex bytes and 'n' characters per iteration
-        for i in range(0, len(s), wth*2):           # break into lines
-            seg = s[i:i+wth*2]
-            byts = []
-            chrs  = ''
-            for j in range(0, len(seg), 2):         # break into bytes
-                byts.append(seg[j:j+2])
-                chrs  += prntabl(int(byts[-1], 16))
-            yield i//2, byts, chrs
-
-    for n, hexline, chrline in bytegen(s, wth):
-        rval.append('0x%08x  %-*s %s' % (addr+n, wth*3, ' '.join(hexline),
-                                         chrline))
+    for i in range(0, len(data), wth):              # break into lines
+        seg = data[i:i+wth]
+        rval.append('0x%08x  %-*s %s' % (addr+i, wth*3, seg.hex(' '),
+                                         seg.translate(Printable).decode('ascii')))
     return rval
 
 def parse_xml(data):
@@ -535,6 +669,14 @@ def parse_xml(data):
 
     return root
 
+def rdp_unescape(s):
+    # binary data in rdp replies escapes $ # } and * as '}' then the
+    # char xor 0x20 (so an escaped char is never a '}' itself)
+    if not '}' in s:
+        return s
+    parts = s.split('}')
+    return parts[0] + ''.join([chr(ord(p[0]) ^ 0x20) + p[1:] for p in parts[1:] if p])
+
 def search_xml(data, search_str):
     # look for a specific tag
     tags = [t.replace('>', ' ') for t in data.split('<')[1:]]
@@ -556,161 +698,703 @@ def search_xml(data, search_str):
     return rvals
 
 
-_feature_reads_to_process = []
+def apply_tdesc(tdesc):
+    # load the arch module a target description names, and hand it
+    # the registers of each feature
+    global Arch_name
+    if tdesc['arch']:
+        Log.write('## arch [%s]\n' % tdesc['arch'])
+        Arch_name = tdesc['arch']
+        # hacks for names I hope they will change ...
+        if Arch_name == 'i386:x86-64':
+            Arch_name = 'i386'
+        Log.write('## archname [%s]' % Arch_name + '\n')
+    load_arch_module()
+    # registers are numbered in description order, a regnum resets the count
+    Tdesc_regnums.clear()
+    n = 0
+    for name, regs in tdesc['features']:
+        Arch.generate_gspec(name, regs)
+        for reg in regs:
+            if 'regnum' in reg:
+                n = int(reg['regnum'])
+            Tdesc_regnums[reg['name']] = n
+            n += 1
+    Gspec_layouts.clear()
+
+def tdesc_path(key):
+    return os.path.join(Tdesc_cache_dir, 'tdesc-%s.json' % key)
+
+def tdesc_load(key):
+    # a cached target description, or None.  not used when recording or
+    # replaying, a replay has to ask for exactly what was recorded.
+    if Record_file or Replay_file or not Tdesc_cache_dir:
+        return None
+    try:
+        with open(tdesc_path(key)) as f:
+            tdesc = json.load(f)
+        if tdesc.get('version') != Tdesc_version or tdesc.get('key') != key:
+            return None
+    except (OSError, ValueError):
+        return None
+    Log.write('target description from %s\n' % tdesc_path(key))
+    return tdesc
 
-class GdbClient(asyncore.dispatcher):
+def tdesc_save(key, tdesc):
+    if Record_file or Replay_file or not Tdesc_cache_dir:
+        return
+    try:
+        os.makedirs(Tdesc_cache_dir, exist_ok=True)
+        with open(tdesc_path(key), 'w') as f:
+            json.dump(tdesc, f)
+    except OSError as e:
+        Log.write('unable to cache the target description: %s\n' % e, CPhi)
+
+class GdbCmd(object):
+    # one rdp command, the GdbClient method that handles its reply,
+    # and the future that is resolved with whatever the handler returns
+    def __init__(self, cmd, handler, future):
+        self.cmd = cmd
+        self.handler = handler
+        self.future = future
+        self.queued = time.perf_counter()
+        self.sent = None
+        self.txlen = 0
+
+def cmd_kind(cmd):
+    # group rdp commands for the stats: g, m, Hg, vCont, qXfer, ...
+    if cmd.startswith('vCont'):
+        return 'vCont'
+    elif cmd[0] in 'qQ':
+        return cmd.split(':')[0]
+    elif cmd[:2] in ['Hg', 'Z0', 'Z2', 'z0', 'z2']:
+        return cmd[:2]
+    return cmd[0]
+
+class Histogram(object):
+    # a running histogram of latencies in seconds, in log spaced buckets
+    # (Stats_steps per doubling, from 1us), so percentiles are good to
+    # about a bucket (9%) and cost no sorting however many samples
+    def __init__(self):
+        self.counts = {}                # bucket: samples in it
+        self.n = 0
+
+    def append(self, secs):
+        b = 0
+        if secs > 1e-6:
+            b = int(math.log2(secs * 1e6) * Stats_steps) + 1
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.n += 1
+
+    def percentile(self, p):
+        # the middle of the bucket holding the pth sample
+        if self.n == 0:
+            return 0
+        rank = int(p * (self.n - 1) + 0.5)
+        for b in sorted(self.counts):
+            rank -= self.counts[b]
+            if rank < 0:
+                break
+        if b == 0:
+            return 1e-6
+        return 1e-6 * 2 ** ((b - 0.5) / Stats_steps)
+
+class PacketStats(object):
+    # timings of one kind of rdp command, the samples are in seconds:
+    # wait is queued to sent, rtt is sent to reply, handle is the time
+    # spent in the process_xxx handler (rendering included)
+    def __init__(self):
+        self.n = 0
+        self.txbytes = 0
+        self.rxbytes = 0
+        self.first = None
+        self.last = None
+        self.wait = Histogram()
+        self.rtt = Histogram()
+        self.handle = Histogram()
+
+    def add(self, gcmd, replied, done, rxlen):
+        self.n += 1
+        self.txbytes += gcmd.txlen
+        self.rxbytes += rxlen
+        if self.first == None:
+            self.first = gcmd.sent
+        self.last = done
+        self.wait.append(gcmd.sent - gcmd.queued)
+        self.rtt.append(replied - gcmd.sent)
+        self.handle.append(done - replied)
+
+def stats_report(stats):
+    # stats is {kind: PacketStats}, times are reported in milliseconds
+    lines = ['kind                 n  tx KB  rx KB wait50  rtt50  rtt99 hndl50 hndl99 pkt/s']
+    for kind in sorted(stats.keys(), key=lambda k: -stats[k].n):
+        ps = stats[kind]
+        secs = ps.last - ps.first
+        lines.append('%-15s %6d %6.1f %6.1f %6.2f %6.2f %6.2f %6.2f %6.2f %5s' % (
+                    kind[:15], ps.n, ps.txbytes / 1024, ps.rxbytes / 1024,
+                    ps.wait.percentile(0.5) * 1000,
+                    ps.rtt.percentile(0.5) * 1000, ps.rtt.percentile(0.99) * 1000,
+                    ps.handle.percentile(0.5) * 1000, ps.handle.percentile(0.99) * 1000,
+                    '%d' % (ps.n / secs) if ps.n > 1 and secs > 0 else '-'))
+    return lines
+
+def dump_stats():
+    with open(Stats_file, 'w') as fh:
+        fh.write('\n'.join(stats_report(Gdbc.stats)) + '\n')
+    Log.write('rdp stats saved to %s\n' % Stats_file)
+
+class MemRead(object):
+    # one target memory read, split into m commands whose replies fit in
+    # the stub's PacketSize.  parts collects the hex data by address until
+    # every chunk has answered.
+    def __init__(self, addr, length, future):
+        self.addr = addr
+        self.length = length
+        self.future = future
+        self.parts = {}
+        self.pending = 0
+        self.error = None
+
+class MemCache(object):
+    # target memory in Mem_page_size pages of bytes.  the target can
+    # only change memory while it runs (or when we write it), so the whole
+    # cache is dropped on resume, on M writes and on (re)connect, and the
+    # epoch keeps reads that were issued before that out of the new cache.
+    # reads are clamped to what was asked for, so a page may hold only
+    # part of its bytes.
+    def __init__(self):
+        self.pages = {}                 # page addr: (offset in page, bytes)
+        self.fetching = {}              # page addr: (start, end, future) of its read
+        self.epoch = 0
+
+    def invalidate(self):
+        self.pages = {}
+        self.fetching = {}
+        self.epoch += 1
+
+    def covers(self, page, start, end):
+        # True if [start, end) of page is cached or on its way
+        if page in self.pages:
+            off, data = self.pages[page]
+            if page + off <= start and end <= page + off + len(data):
+                return True
+        if page in self.fetching:
+            s, e, fut = self.fetching[page]
+            if s <= start and end <= e:
+                return True
+        return False
+
+    def fill(self, start, end, fut, epoch):
+        # a read of [start, end) is done, keep its bytes if still current
+        if epoch != self.epoch:
+            return
+        data = fut.result()
+        page = start - start % Mem_page_size
+        while page < end:
+            if page in self.fetching and self.fetching[page][2] == fut:
+                del self.fetching[page]
+            if isinstance(data, bytes) and len(data) == end - start:
+                s = max(start, page)
+                e = min(end, page + Mem_page_size)
+                self.store(page, s - page, data[s-start:e-start])
+            page += Mem_page_size
+
+    def store(self, page, off, data):
+        # merge with what the page already holds if the two touch
+        if page in self.pages:
+            off0, data0 = self.pages[page]
+            if off0 <= off + len(data) and off <= off0 + len(data0):
+                lo = min(off, off0)
+                buf = bytearray(max(off + len(data), off0 + len(data0)) - lo)
+                buf[off0-lo:off0-lo+len(data0)] = data0
+                buf[off-lo:off-lo+len(data)] = data
+                off, data = lo, bytes(buf)
+        self.pages[page] = (off, data)
+
+    def lookup(self, addr, length):
+        # the bytes at addr,length if every part of them is here
+        parts = []
+        end = addr + length
+        while addr < end:
+            page = addr - addr % Mem_page_size
+            if not page in self.pages:
+                return None
+            off, data = self.pages[page]
+            s = addr - page
+            e = min(end, page + Mem_page_size) - page
+            if s < off or e > off + len(data):
+                return None
+            parts.append(data[s-off:e-off])
+            addr = page + e
+        return b''.join(parts)
+
+def remote_name():
+    if Remote_medium == 'tcp':
+        return 'tcp:%s:%d' % Host_port
+    return Remote_medium + ':' + Remote_path
+
+class PipeTransport(object):
+    # a pty, or a child process's stdin and stdout, is a pair of one way
+    # transports.  this is enough of a socket transport for GdbClient.
+    def __init__(self, wtransport, others):
+        self.wtransport = wtransport
+        self.transports = [wtransport] + others
+
+    def write(self, data):
+        self.wtransport.write(data)
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+
+class PtyProtocol(asyncio.Protocol):
+    # the read side of a pty, everything goes to the GdbClient
+    def __init__(self, gdbc, wtransport):
+        self.gdbc = gdbc
+        self.wtransport = wtransport
+
+    def connection_made(self, transport):
+        self.gdbc.connection_made(PipeTransport(self.wtransport, [transport]))
+
+    def data_received(self, data):
+        self.gdbc.data_received(data)
+
+    def connection_lost(self, exc):
+        self.gdbc.connection_lost(exc)
+
+class StdioProtocol(asyncio.SubprocessProtocol):
+    # a qemu child started with -gdb stdio, its stdout goes to the
+    # GdbClient and its stderr to the log window
+    def __init__(self, gdbc):
+        self.gdbc = gdbc
+
+    def connection_made(self, transport):
+        self.gdbc.connection_made(PipeTransport(transport.get_pipe_transport(0),
+                                                [transport]))
+
+    def pipe_data_received(self, fd, data):
+        if fd == 1:
+            self.gdbc.data_received(data)
+        else:
+            Log.write(data.decode('latin-1'), CPhi)
+
+    def process_exited(self):
+        self.gdbc.connection_lost(None)
+
+class SessionRecorder(object):
+    # -record: every chunk of rdp bytes sent ('s') or received ('r') and
+    # every key pressed ('k') goes to the session file as
+    #     <secs since start> <kind> <length>\n<raw bytes>\n
+    # so packets are stored as is, binary or not.
+    def __init__(self, fname):
+        self.fh = open(fname, 'wb')
+        self.fh.write(b'pgdb session 1\n')
+        self.t0 = time.time()
+
+    def record(self, kind, data):
+        self.fh.write(b'%.6f %s %d\n' % (time.time() - self.t0, kind, len(data)))
+        self.fh.write(data)
+        self.fh.write(b'\n')
+
+    def close(self):
+        self.fh.close()
+
+class RecordingTransport(object):
+    # records what GdbClient sends on its way to the real transport
+    def __init__(self, transport, session):
+        self.transport = transport
+        self.session = session
+
+    def write(self, data):
+        self.session.record(b's', data)
+        self.transport.write(data)
+
+    def close(self):
+        self.transport.close()
+
+def read_session(fname):
+    # returns a list of (secs, kind, data) from a -record session file
+    records = []
+    with open(fname, 'rb') as fh:
+        if fh.readline() != b'pgdb session 1\n':
+            raise Exception('%s is not a pgdb session file' % fname)
+        while True:
+            hdr = fh.readline()
+            if len(hdr) == 0:
+                break
+            secs, kind, n = hdr.split()
+            data = fh.read(int(n))
+            fh.read(1)
+            records.append((float(secs), kind, data))
+    return records
+
+class ReplayTransport(object):
+    # -replay: stands in for the stub.  received chunks are handed to
+    # the GdbClient (and recorded keys to the key handler) as soon as
+    # pgdb has sent everything that preceded them in the recording,
+    # so the session runs at full speed with no qemu timing involved.
+    def __init__(self, gdbc, fname, keyfn):
+        self.gdbc = gdbc
+        self.keyfn = keyfn
+        self.records = collections.deque()  # (kind, data, bytes sent before it)
+        self.expected = bytearray()     # everything pgdb sent, in order
+        self.secs = 0
+        for secs, kind, data in read_session(fname):
+            if kind == b's':
+                self.expected += data
+            else:
+                self.records.append((kind, data, len(self.expected)))
+            self.secs = secs
+        self.written = 0
+        self.diverged = False
+        self.key_pending = False
+        self.nrecv = 0
+        self.t0 = time.time()
+        Log.write('replaying %s: %d records, %.3f secs recorded\n' % (
+                                fname, len(self.records), self.secs))
+        asyncio.get_event_loop().call_soon(self.pump)
+
+    def write(self, data):
+        n = len(data)
+        if not self.diverged \
+        and self.expected[self.written:self.written+n] != data:
+            Log.write('replay diverged at sent byte %d: [%s] recorded [%s]\n' % (
+                        self.written, str(data, 'latin-1'),
+                        str(self.expected[self.written:self.written+n], 'latin-1')),
+                        CPerr)
+            self.diverged = True
+        self.written += n
+        asyncio.get_event_loop().call_soon(self.pump)
+
+    def pump(self):
+        if self.key_pending:
+            return
+        while len(self.records) > 0 and self.records[0][2] <= self.written:
+            kind, data, sent = self.records.popleft()
+            if kind == b'r':
+                self.nrecv += len(data)
+                self.gdbc.data_received(data)
+            elif kind == b'k':
+                # a key comes a moment after the traffic before it, like
+                # it did live, so whatever that traffic woke up has run
+                self.key_pending = True
+                asyncio.get_event_loop().call_later(Replay_key_delay, self.key, data)
+                return
+            if len(self.records) == 0:
+                self.done()
+
+    def key(self, data):
+        self.key_pending = False
+        self.keyfn(int(data))
+        if len(self.records) == 0:
+            self.done()
+        self.pump()
+
+    def done(self):
+        Log.write('replay done: %d bytes received in %.3f secs (%.3f recorded)\n' % (
+                    self.nrecv, time.time() - self.t0, self.secs), CPok)
+
+    def close(self):
+        pass
+
+class GdbClient(asyncio.BufferedProtocol):
+    # the rdp connection is an asyncio protocol: the event loop in main()
+    # reads reply bytes into rdata as soon as they arrive (get_buffer() and
+    # buffer_updated() are the asyncio form of recv_into), so replies are
+    # parsed and rendered immediately instead of on the next keyboard poll.
+    # rdata is reused for the life of the connection; packets are located
+    # with bytes.find() and only decoded to a str once they are complete.
+    #
+    # queue_cmd() returns a future that is resolved with whatever the
+    # matching process_xxx() handler returns (process_stop returns the
+    # stop reasons, process_regs the new register dict, process_mem the
+    # memory data) so code that wants a result can simply await it.
+    #
+    # up to Pipeline_depth commands are kept in flight.  the gdb stub
+    # answers strictly in order, so each reply belongs to the oldest
+    # command in self.inflight and is handed to that command's handler.
+    # commands that resume the target are barriers: they go out alone,
+    # and nothing else is sent until their stop reply has arrived.
 
     def __init__(self):
-        asyncore.dispatcher.__init__(self)
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.connect(Host_port)
-        self.cmds = []
-        self.sbuf = ''
-        self.rbuf = ''
-        self.rchksm = ''
-        self.lastcmd = None
-        self.state = None
+        self.transport = None
+        self.cmds = []                  # GdbCmds not yet sent
+        self.inflight = []              # GdbCmds sent, awaiting replies
+        self.rdata = bytearray(Rbuf_size)   # receive buffer, reused
+        self.rview = memoryview(self.rdata)
+        self.rlen = 0                   # bytes of rdata not yet parsed
+        self.rbuf = ''                  # the current reply packet
+        self.lastcmd = None             # the cmd the current reply is for
+        self.noack = False              # True once QStartNoAckMode is on
+        self.packet_size = Packet_size  # max packet the stub can handle
         self.nthreads = 0
         self._threads = []
         self.current_thread = None      # 1 based
         self.stopped_thread = None      # None = emulator running
+        self.refresh_timer = None       # pending refresh_stale()
+        self.stale = set()              # cpus not read since the last stop
+        self.xfer_threads = False       # stub has qXfer:threads:read
+        self.relist = False             # a stop reported a new thread
+        self.stats = {}                 # cmd_kind: PacketStats
+        self.memcache = MemCache()
+        self.p_ok = True                # False once the stub rejects 'p'
+        self.p_bad = set()              # spec_lens 'p' widths don't fit
+        self.rxlen = 0                  # framed length of the current reply
+        self.supported = ''             # the qSupported reply
         # eventually support all this?  qemu doesn't yet ...
         #self.queue_cmd('qSupported:multiprocess+;xmlRegisters=i386;qRelocInsn+')
         # initiate the startup sequence
         self.queue_cmd('qSupported')
 
-    def handle_connect(self):
-        pass
-
-    def handle_close(self):
-        self.close()
-
-    def handle_error(self):
-        if str(sys.exc_info()[1]).find('[Errno 111]') >= 0:
-            Log.write('cannot connect to %s (Connection refused)' %
-                        str(Host_port) + ' is qemu running with -s ?\n', CPerr)
-        else:
-            Log.write('GdbClient exception: %s\n' % traceback.format_exc(), CPerr)
+    async def connect(self):
+        loop = asyncio.get_event_loop()
+        try:
+            if Remote_medium == 'unix':
+                # qemu -gdb unix:path,server
+                await loop.create_unix_connection(lambda: self, Remote_path)
+            elif Remote_medium == 'pty':
+                await self.connect_pty(loop)
+            elif Remote_medium == 'stdio':
+                await loop.subprocess_exec(lambda: StdioProtocol(self),
+                                           *shlex.split(Remote_path),
+                                           stdin=asyncio.subprocess.PIPE,
+                                           stdout=asyncio.subprocess.PIPE,
+                                           stderr=asyncio.subprocess.PIPE)
+            else:
+                await loop.create_connection(lambda: self, Host_port[0], Host_port[1])
+        except OSError:
+            if str(sys.exc_info()[1]).find('[Errno 111]') >= 0:
+                Log.write('cannot connect to %s (Connection refused)' %
+                            remote_name() + ' is qemu running with -s ?\n', CPerr)
+            elif isinstance(sys.exc_info()[1], FileNotFoundError):
+                Log.write('cannot connect to %s (%s)\n' % (
+                            remote_name(), sys.exc_info()[1].strerror), CPerr)
+            else:
+                Log.write('GdbClient exception: %s\n' % traceback.format_exc(), CPerr)
+            refresh_all()
+
+    async def connect_pty(self, loop):
+        # qemu -gdb pty prints the /dev/pts/N it picked.  put our end in
+        # raw mode so the tty line discipline leaves the packets alone.
+        fd = os.open(Remote_path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(fd)
+        wtransport, _ = await loop.connect_write_pipe(asyncio.Protocol,
+                                                os.fdopen(os.dup(fd), 'wb', 0))
+        await loop.connect_read_pipe(lambda: PtyProtocol(self, wtransport),
+                                     os.fdopen(fd, 'rb', 0))
+
+    def connection_made(self, transport):
+        if Session:
+            transport = RecordingTransport(transport, Session)
+        self.transport = transport
+        self.noack = False              # every new connection starts in ack mode
+        self.rlen = 0
+        self.memcache.invalidate()
+        self.send_next()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        Log.write('connection to %s closed\n' % remote_name(), CPerr)
+        refresh_all()
 
-    def writable(self):
-        if len(self.sbuf) > 0:
-            return True
-        if self.state == None and self.lastcmd == None and len(self.cmds) > 0:
-            return True
-        return False
+    def is_barrier(self, cmd):
+        # step, continue and kill: the target stops answering until it stops.
+        # QStartNoAckMode changes the framing of everything that follows.
+        return cmd.startswith('vCont;') or cmd[0] in 'sck' \
+            or cmd == 'QStartNoAckMode'
 
-    def handle_write(self):
-        if len(self.cmds) <= 0:
+    def send_next(self):
+        # fill the pipeline
+        if self.transport == None:
             return
-        cmd = self.cmds.pop(0)
-        self.lastcmd = cmd
-        s = '$' + cmd + '#' + "%02x" % (sum([ord(c) for c in cmd]) & 0xff)
-        self.sbuf = s.encode('ascii')
-        #DEBUG Log.write('w-- ' + str(self.sbuf) + '\n')
-        sent = self.send(self.sbuf)
-        self.sbuf = self.sbuf[sent:]
-
-    def queue_cmd(self, cmd):
-        self.cmds.append(cmd)
-
-    def handle_read(self):
-        data = self.recv(8192).decode('ascii')
-        #DEBUG Log.write('r-- ' + data + '\n')
+        while len(self.cmds) > 0 and len(self.inflight) < Pipeline_depth:
+            if len(self.inflight) > 0 \
+            and (self.is_barrier(self.cmds[0].cmd)
+                 or self.is_barrier(self.inflight[-1].cmd)):
+                break
+            gcmd = self.cmds.pop(0)
+            self.inflight.append(gcmd)
+            cmd = gcmd.cmd
+            s = '$' + cmd + '#' + "%02x" % (sum([ord(c) for c in cmd]) & 0xff)
+            #DEBUG Log.write('w-- ' + s + '\n')
+            gcmd.sent = time.perf_counter()
+            gcmd.txlen = len(s)
+            self.transport.write(s.encode('ascii'))
+
+    def queue_cmd(self, cmd, handler=None):
+        # handler defaults to the process_xxx method for this kind of cmd
+        if self.is_barrier(cmd) and self.refresh_timer:
+            # resuming, the deferred refresh would only see stale state
+            self.refresh_timer.cancel()
+            self.refresh_timer = None
+        if self.is_barrier(cmd) or cmd[0] == 'M':
+            # the target (or we) may change memory from here on
+            self.memcache.invalidate()
+        if handler == None:
+            handler = self.reply_handler(cmd)
+        fut = asyncio.get_event_loop().create_future()
+        self.cmds.append(GdbCmd(cmd, handler, fut))
+        self.send_next()
+        return fut
+
+    def reply_handler(self, cmd):
+        if cmd == 'qSupported':
+            return self.process_supported
+        elif cmd == 'QStartNoAckMode':
+            return self.process_noack
+        elif cmd[:5] in ['?', 's', 'c', 'vCont']:
+            return self.process_stop
+        elif cmd == 'g':
+            return self.process_regs
+        elif cmd[0] == 'p':
+            return self.process_reg
+        elif cmd[0] == 'm':
+            return self.process_mem
+        elif cmd == 'qC' or cmd.startswith('Hg'):
+            return self.process_currentthread
+        elif cmd in ['qfThreadInfo', 'qsThreadInfo']:
+            return self.process_threadinfo
+        return self.process_other
+
+    def get_buffer(self, sizehint):
+        # the transport recv_into()s straight into the free tail of rdata
+        if len(self.rdata) - self.rlen < Rbuf_min_free:
+            self.grow_rdata(len(self.rdata) * 2)
+        return self.rview[self.rlen:]
+
+    def buffer_updated(self, nbytes):
+        #DEBUG Log.write('r-- ' + str(self.rview[self.rlen:self.rlen+nbytes], 'latin-1') + '\n')
+        if Session:
+            Session.record(b'r', self.rview[self.rlen:self.rlen+nbytes])
+        self.rlen += nbytes
+        self.received()
+
+    def data_received(self, data):
+        # transports that don't support get_buffer() (pipes) land here
+        if Session:
+            Session.record(b'r', data)
         self.process_read(data)
+        self.received()
 
-    def process_read(self, data):
-        # two nested state machines here,
-        # the 'outside' sm parses $...#..
-        # the 'inside' sm collects rbuf and rchksm strings
-        # lastcmd remembers the cmd that triggered the current response
-        for c in data:
-            if self.state == None:
-                # state is inactive - we are outside of a msg packet
-                if c == '$':
-                    self.state = '$'
-                    self.rbuf = ''
-                    self.rchksm = ''
-                    continue
-                elif c == '+':
-                    #print('msg ok')
-                    continue
-                elif c == '-':
-                    # if over a serial line retransmit might be in order
-                    update_status('**** transmission failure ****', CPerr)
-                    continue
-
-            # else state is active - we are inside a msg packet
-
-            if self.state == '$':
-                if c == '#':
-                    self.state = 'chksm0'
-                else:
-                    # collect characters until checksum
-                    self.rbuf += c
-                continue
+    def received(self):
+        try:
+            self.frame()
+        except:
+            Log.write('GdbClient exception: %s\n' % traceback.format_exc(), CPerr)
+        if Stats.visible:
+            Stats.update_soon()
+        self.send_next()
+        refresh_all()
 
-            if self.state == 'chksm0':
-                # first checksum character
-                self.rchksm += c
-                self.state = 'chksm1'
-                continue
+    def grow_rdata(self, size):
+        # the old memoryview may still be exported, so copy rather than resize
+        rdata = bytearray(size)
+        rdata[:self.rlen] = self.rview[:self.rlen]
+        self.rdata = rdata
+        self.rview = memoryview(rdata)
 
-            if self.state == 'chksm1':
-                # second checksum character
-                self.rchksm += c
-                self.state = None
-                # checksum complete, validate
-                s = "%02x" % (sum([ord(d) for d in self.rbuf]) & 0xff)
-                if s != self.rchksm:
-                    update_status('**** warning: recv checksum mismatch **** [%s,%s]' %
-                                        (s, self.rchksm), CPerr)
-                self.rchksm = ''
-                #Log.write('++ state ' + str(self.state) + ' [%s|%s|%s]' % (
-                #                       c, self.rbuf, self.rchksm))
-
-                # process rbuf
-                if not self.lastcmd or len(self.lastcmd) == 0:
-                    update_status('++ rbuf[%s]' % self.rbuf, CPdbg)
-                    pass
-                elif self.lastcmd == 'qSupported':
-                    self.process_supported()
-                elif self.lastcmd.startswith('qXfer:features:read:'):
-                    self.process_feature_read()
-                elif self.lastcmd[:5] in ['?', 's', 'c', 'vCont']:
-                    self.process_stop()
-                elif self.lastcmd == 'g':
-                    self.process_regs()
-                elif self.lastcmd[0] == 'm':
-                    self.process_mem()
-                elif self.lastcmd == 'qC':
-                    self.process_currentthread()
-                elif self.lastcmd.startswith('Hg'):
-                    self.process_currentthread()
-                elif self.lastcmd == 'qfThreadInfo':
-                    if self.process_threadinfo():
-                        self.queue_cmd('qsThreadInfo')
-                elif self.lastcmd == 'qsThreadInfo':
-                    if self.process_threadinfo():
-                        self.queue_cmd('qsThreadInfo')
-                else:
-                    if self.rbuf != 'OK':
-                        Log.write('++ rdp response to [%s] is [%s]\n' % (
-                                                    self.lastcmd, self.rbuf))
+    def process_read(self, data):
+        # append raw reply bytes to rdata, frame() will parse them
+        n = len(data)
+        if self.rlen + n > len(self.rdata):
+            self.grow_rdata(max(len(self.rdata) * 2, self.rlen + n + Rbuf_min_free))
+        self.rdata[self.rlen:self.rlen + n] = data
+        self.rlen += n
+
+    def frame(self):
+        # split rdata into $...#cs packets, each complete packet answers
+        # the oldest command in flight.  a partial packet is left at the
+        # front of rdata until the rest of it arrives.
+        buf = self.rdata
+        end = self.rlen
+        pos = 0
+        while pos < end:
+            start = buf.find(b'$', pos, end)
+            if start < 0:
+                start = end
+            if start > pos:
+                self.stray(buf[pos:start])
+            pos = start
+            if start == end:
+                break
+            h = buf.find(b'#', start + 1, end)
+            if h < 0 or h + 3 > end:
+                break                   # incomplete, wait for more
+            pos = h + 3
+            s = "%02x" % (sum(self.rview[start+1:h]) & 0xff)
+            rchksm = str(buf[h+1:h+3], 'latin-1')
+            if s != rchksm.lower():
+                update_status('**** warning: recv checksum mismatch **** [%s,%s]' %
+                                    (s, rchksm), CPerr)
+                if not self.noack:
+                    # nak it, the stub will retransmit the packet
+                    self.transport.write(b'-')
+                    continue
+            elif not self.noack:
+                self.transport.write(b'+')
+            self.rbuf = str(self.rview[start+1:h], 'latin-1')
+            self.rxlen = pos - start
+            self.dispatch()
+        # move the unparsed remainder to the front
+        if pos > 0:
+            buf[:end - pos] = buf[pos:end]
+            self.rlen = end - pos
+
+    def stray(self, chars):
+        # bytes outside of a packet: acks, unless no-ack mode is on
+        if not self.noack:
+            if chars.count(b'-'):
+                # if over a serial line retransmit might be in order
+                update_status('**** transmission failure ****', CPerr)
+            chars = chars.replace(b'+', b'').replace(b'-', b'')
+        if len(chars) > 0:
+            update_status('++ stray recv chars [%s]' % str(chars, 'latin-1'), CPerr)
+
+    def dispatch(self):
+        # hand rbuf to the handler of the command it answers
+        if len(self.inflight) == 0:
+            update_status('++ rbuf[%s]' % self.rbuf, CPdbg)
+            self.rbuf = ''
+            return
+        gcmd = self.inflight.pop(0)
+        replied = time.perf_counter()
+        self.lastcmd = gcmd.cmd
+        rval = gcmd.handler()
+        if not gcmd.future.done():
+            gcmd.future.set_result(rval if rval != None else self.rbuf)
+        kind = cmd_kind(gcmd.cmd)
+        if not kind in self.stats:
+            self.stats[kind] = PacketStats()
+        self.stats[kind].add(gcmd, replied, time.perf_counter(), self.rxlen)
+        self.lastcmd = None
+        self.rbuf = ''
+        self.send_next()
 
-                self.lastcmd = None
-                self.rbuf = ''
-            else:
-                update_status('++ stray recv char [%s]' % c, CPerr)
+    def process_other(self):
+        if self.rbuf != 'OK':
+            Log.write('++ rdp response to [%s] is [%s]\n' % (
+                                        self.lastcmd, self.rbuf))
 
     def process_supported(self):
+        self.supported = self.rbuf
         Log.write('++ supported: ' + str(self.rbuf.split(';')) + '\n')
         features = self.rbuf.split(';')
+        if 'QStartNoAckMode+' in features:
+            # on a reliable link acks are just an extra transmit per packet
+            self.queue_cmd('QStartNoAckMode')
         cmds = 0
         for feature in features:
-            if feature == 'qXfer:features:read+':
+            if feature == 'QStartNoAckMode+':
+                pass
+            elif feature.startswith('PacketSize='):
+                self.packet_size = int(feature[11:], 16)
+                Log.write('feature: %s\n' % feature)
+            elif feature == 'qXfer:threads:read+':
+                self.xfer_threads = True
+                Log.write('feature: %s\n' % feature)
+            elif feature == 'qXfer:features:read+':
                 # sweet, we can actually know what arch we need,
-                # ask for the xml
-                self.queue_cmd('qXfer:features:read:target.xml:0,ffb')
+                # ask for the xml (once PacketSize is known)
                 cmds += 1
             else:
                 Log.write('feature: %s\n' % feature)
@@ -718,43 +1402,62 @@ class GdbClient(asyncore.dispatcher):
         if cmds == 0:
             # get the machine state now
             self.queue_cmd('?')             # triggers process_stop
-        # else let process_feature_read get the machine state
-
-    def process_feature_read(self):
-        global Arch_name, _feature_reads_to_process
-        reqfn = self.lastcmd.split(':')[3]
-
-        # get names of xml files available for the target
-        incs = search_xml(self.rbuf, 'xi:include')
-        if len(incs) > 0:
-            _feature_reads_to_process += [inc['href'] for inc in incs]
-
-        if reqfn == 'target.xml':
-            atags = search_xml(self.rbuf, 'architecture')
-            Log.write('## arch ' + str(atags) + '\n')
-            Arch_name = atags[0]['architecture']
-            # hacks for names I hope they will change ...
-            if Arch_name == 'i386:x86-64':
-                Arch_name = 'i386'
-            Log.write('## archname [%s]' % Arch_name + '\n')
-            load_arch_module()
-
-        #Log.write('## reqfn [%s]\n' % reqfn)
-        #Log.write('## includes ' + str(_feature_reads_to_process) + '\n')
-
-        # qemu 3.x
-        feature = search_xml(self.rbuf, 'feature')
-        if len(feature) > 0  and  'name' in feature[0]:
-            Arch.generate_gspec(feature[0]['name'], search_xml(self.rbuf, 'reg'))
-            #logs parse output ...  tree = parse_xml(self.rbuf)
-
-        if len(_feature_reads_to_process) == 0:
-            # then get the machine state
-            self.queue_cmd('?')             # triggers process_stop
         else:
-            self.queue_cmd('qXfer:features:read:%s:0,ffb' % _feature_reads_to_process.pop(0))
-
-
+            # let read_features get the machine state
+            asyncio.ensure_future(self.read_features())
+
+    def process_noack(self):
+        # our '+' for this reply has already gone out, so if the stub
+        # agreed, neither side acks anything from here on
+        if self.rbuf == 'OK':
+            self.noack = True
+            Log.write('no-ack mode enabled\n')
+        else:
+            Log.write('stub refused QStartNoAckMode [%s], staying in ack mode\n' %
+                                    self.rbuf, CPhi)
+
+    async def read_features(self):
+        # target.xml names the architecture and xi:includes the docs that
+        # describe the registers.  the parsed description is cached on
+        # disk, so reconnecting to the same qemu only costs the target.xml
+        # read.  the included docs aren't read to check it, so the cache
+        # key is a hash of the qSupported reply (which changes with the
+        # qemu build and its options) as well as of target.xml, and the
+        # key is stored in the entry and compared when it's loaded.
+        target = await self.qxfer_read('features', 'target.xml')
+        if target != None:
+            key = hashlib.sha1((self.supported + '\n' + target).encode('latin-1')).hexdigest()
+            tdesc = tdesc_load(key)
+            if tdesc == None:
+                tdesc = await self.parse_tdesc(target)
+                tdesc['key'] = key
+                tdesc_save(key, tdesc)
+            apply_tdesc(tdesc)
+        # then get the machine state
+        self.queue_cmd('?')             # triggers process_stop
+
+    async def parse_tdesc(self, target):
+        # the architecture, and the registers of each feature, from
+        # target.xml and everything it includes
+        tdesc = {'version': Tdesc_version, 'arch': None, 'features': []}
+        atags = search_xml(target, 'architecture')
+        if len(atags) > 0:
+            tdesc['arch'] = atags[0]['architecture']
+        docs = [target]
+        while len(docs) > 0:
+            doc = docs.pop(0)
+            if doc == None:
+                continue
+            # qemu 3.x
+            feature = search_xml(doc, 'feature')
+            if len(feature) > 0  and  'name' in feature[0]:
+                tdesc['features'].append([feature[0]['name'], search_xml(doc, 'reg')])
+            # the includes go out together, then get parsed in order
+            futs = [self.qxfer_read('features', inc['href'])
+                    for inc in search_xml(doc, 'xi:include')]
+            for fut in futs:
+                docs.append(await fut)
+        return tdesc
 
     def process_stop(self):
 
@@ -773,25 +1476,161 @@ class GdbClient(asyncore.dispatcher):
         self.delete_breakpoints()
         reasons = self.rbuf[3:].split(';')
         st = 'stopped:'
+        expedited = {}
         for reason in reasons:
             if len(reason) > 0:
-                n, r = reason.split(':')
-                if n == 'thread':
+                n, _, r = reason.partition(':')
+                if n == 'create':
+                    # a new thread, the thread list has to be read again
+                    self.relist = True
+                    st += '  reason=' + reason
+                elif n == 'thread':
                     th = int(r, 16)
                     self.stopped_thread = th
                     st += ' cpu%d' % (th-1)
+                elif all([c in string.hexdigits for c in n]):
+                    # an expedited register, n is the gdb register number
+                    expedited[int(n, 16)] = r
                 else:
                     st += '  reason=' + reason
         update_status(st, CPnrm)
-        # initiate reload of all cpu regs
-        self.queue_cmd('qfThreadInfo')
+        if self.refresh_timer:
+            self.refresh_timer.cancel()
+            self.refresh_timer = None
+        self.stale = set()      # refresh_cpus() decides again
+        self.refresh_cpus(self.expedite(expedited))
         # refetch all the mem windows.
-        # yup, memory fetch requests interlaced with qfThreadInfo!
+        # yup, memory fetch requests interlaced with register reads!
         # yea, the qemu gdbstub seems to have no problem with this!
-        for mem in Mems:
-            mem.refetch()
+        refetch_mems()
+        return reasons
+
+    def expedite(self, expedited):
+        # apply the registers carried by a T stop reply to the stopped cpu.
+        # returns False when a full 'g' fetch is needed instead.
+        th = self.stopped_thread
+        if len(expedited) == 0 or th == None or not th-1 in Cpus.keys():
+            return False
+        cpu = Cpus[th-1]
+        if not cpu.spec_len in Arch.spec.keys():
+            return False
+        nums = gspec_regnums(Arch.spec[cpu.spec_len]['gspec'])
+        names = dict((n, name) for name, n in nums.items())
+        newregs = dict(cpu.regs)
+        for n, val in expedited.items():
+            if not n in names:
+                return False
+            try:
+                newregs[names[n]] = int.from_bytes(binascii.unhexlify(val), 'little')
+            except (binascii.Error, ValueError):
+                return False
+        cpu.update(newregs, cpu.spec_len)
+        return True
 
-    def process_regs(self):
+    def refresh_threads(self):
+        # find all the threads/cpus, fetching each one's regs.  the list
+        # comes in one qXfer:threads:read if the stub has it, otherwise
+        # it takes a qfThreadInfo/qsThreadInfo round trip per thread.
+        self.refresh_timer = None
+        self.relist = False
+        if self.xfer_threads:
+            asyncio.ensure_future(self.read_threads())
+        else:
+            self.queue_cmd('qfThreadInfo')
+
+    def qxfer_read(self, obj, annex):
+        # read a whole qXfer object in packet sized pieces.  each reply is
+        # 'm' (more to come) or 'l' (the last piece) and then the data.
+        # the returned future gets the document, or None if the stub
+        # refused (an empty or error reply).
+        fut = asyncio.get_event_loop().create_future()
+        self.queue_qxfer(obj, annex, 0, [], fut)
+        return fut
+
+    def queue_qxfer(self, obj, annex, offset, parts, fut):
+        # leave room for the reply's 'm'/'l', $ and #cs
+        length = max(1, self.packet_size - 5)
+        self.queue_cmd('qXfer:%s:read:%s:%x,%x' % (obj, annex, offset, length),
+                       lambda: self.process_qxfer(obj, annex, offset, parts, fut))
+
+    def process_qxfer(self, obj, annex, offset, parts, fut):
+        data = rdp_unescape(self.rbuf[1:])
+        if self.rbuf[:1] == 'm' and len(data) > 0:
+            parts.append(data)
+            self.queue_qxfer(obj, annex, offset + len(data), parts, fut)
+        elif self.rbuf[:1] in ['m', 'l']:
+            parts.append(data)
+            fut.set_result(''.join(parts))
+        else:
+            Log.write('++ qXfer:%s:read:%s failed [%s]\n' % (obj, annex, self.rbuf), CPhi)
+            fut.set_result(None)
+
+    def relist_threads(self):
+        # the 'r' key: find the threads again, then reorder their panels
+        global Reorder_cpus
+        Reorder_cpus = True
+        self.refresh_threads()
+
+    def refresh_cpus(self, expedited):
+        # after a stop only the stopped cpu (unless the stop reply already
+        # brought it up to date) and the active cpu are read right away.
+        # the rest are marked stale and read when their panel is activated,
+        # or once stepping pauses for a moment.  (with -smp 64 that's a few
+        # round trips per step instead of a hundred and thirty)
+        if len(self._threads) == 0  or  self.relist:
+            # the first stop or a new thread, find all the threads/cpus
+            self.refresh_threads()
+            return
+        self.stale = set(self._threads)
+        now = []
+        if Active_cpu:
+            now.append(Active_cpu.i)
+        if self.stopped_thread and not self.stopped_thread-1 in now:
+            now.append(self.stopped_thread-1)
+        if expedited and self.stopped_thread and self.stopped_thread-1 in now:
+            now.remove(self.stopped_thread-1)
+        stopped_regs = None
+        for i in now:
+            fut = self.refresh_cpu(i)
+            if self.stopped_thread and i == self.stopped_thread-1:
+                stopped_regs = fut
+        if len(now) > 0:
+            self.restore_thread()
+        # like threads_done(), follow the stopped cpu once its regs are in
+        if stopped_regs:
+            stopped_regs.add_done_callback(lambda fut: self.follow_stop())
+        else:
+            self.follow_stop()
+        self.refresh_timer = asyncio.get_event_loop().call_later(
+                                Regs_refresh_delay, self.refresh_stale)
+
+    def refresh_cpu(self, i):
+        self.stale.discard(i)
+        self.queue_cmd('Hg%02x' % (i+1))
+        return self.fetch_regs(i+1)
+
+    def refresh_stale(self):
+        # the idle time read of every cpu not read since the last stop
+        self.refresh_timer = None
+        if self.stopped_thread == None or len(self.stale) == 0:
+            return
+        for i in sorted(self.stale):
+            self.refresh_cpu(i)
+        self.restore_thread()
+
+    def activated_cpu(self, cpu):
+        # a stale cpu panel became active, bring it up to date now
+        if cpu.i in self.stale and self.stopped_thread:
+            self.refresh_cpu(cpu.i)
+            self.restore_thread()
+
+    def restore_thread(self):
+        # the stub reads memory through the current thread's cpu,
+        # so go back to the stopped one after reading other cpus
+        if self.stopped_thread:
+            self.queue_cmd('Hg%02x' % self.stopped_thread)
+
+    def process_regs(self, th=None):
         global Arch, Arch_name
         # currently the only way to know qemu has switched cpu modes is by
         # the length of the get register data!  if the current module doesn't
@@ -817,13 +1656,9 @@ class GdbClient(asyncore.dispatcher):
                 Log.write(err.replace('-', '****\n****') + '\n', attr=CPerr)
                 return
 
-        th = self.current_thread
-        i = n = 0
-        newregs = {}
-        for spec in Arch.spec[spec_len]['gspec']:
-            if spec[2] <= spec_len:
-                val = lsn2msn(self.rbuf[spec[1]:spec[2]])
-                newregs[spec[0]] = int(val, 16)
+        if th == None:
+            th = self.current_thread
+        newregs = gspec_decode(self.rbuf, spec_len)
 
         # during the first pass, Cpus objects may not have been created
         if not th-1 in Cpus.keys():
@@ -831,51 +1666,257 @@ class GdbClient(asyncore.dispatcher):
         Cpus[th-1].update(newregs, spec_len)
         #Log.write('++++ newregs ' + str(newregs), CPdbg)
         refresh_all()
+        return newregs
         # humm.... would like to fetch about 8 bytes of memory at the ip,
         # but I'm not sure multiple rdp queued commands work asynchronously
         #addr = Arch.compute_ip_address()
         #self.queue_cmd('m%08x,8' % addr)
 
+    def fetch_regs(self, th):
+        # 'g' reads every register.  with -regfetch p, once a 'g' has shown
+        # which registers the cpu panel uses, just those are read with
+        # pipelined 'p' packets (if any of them has no known register
+        # number it's a 'g' after all).  the current thread must already
+        # be th.  returns a future that is done once the regs are in.
+        regnums = self.p_regnums(th)
+        if regnums == None:
+            return self.queue_cmd('g', lambda: self.process_regs(th))
+        futs = [self.queue_cmd('p%x' % n) for name, n, width in regnums]
+        return asyncio.ensure_future(self.p_regs_done(th, regnums, futs))
+
+    def p_regnums(self, th):
+        # [(name, regnum, hex digits)] of the registers cpu th displays,
+        # or None if a 'g' is needed
+        if Reg_fetch != 'p' or not self.p_ok or not th-1 in Cpus.keys():
+            return None
+        cpu = Cpus[th-1]
+        if not cpu.spec_len in Arch.spec.keys() or len(cpu.regs.seen) == 0:
+            return None
+        if cpu.spec_len in self.p_bad:
+            return None
+        gspec = Arch.spec[cpu.spec_len]['gspec']
+        nums = gspec_regnums(gspec)
+        widths = dict((spec[0], spec[2] - spec[1]) for spec in gspec)
+        regnums = []
+        for name in cpu.regs.seen:
+            if not name in nums:
+                return None     # a 'p' read would leave it stale
+            regnums.append((name, nums[name], widths[name]))
+        return sorted(regnums, key=lambda r: r[1])
+
+    def process_reg(self):
+        return self.rbuf
+
+    async def p_regs_done(self, th, regnums, futs):
+        replies = await asyncio.gather(*futs)
+        cpu = Cpus[th-1]
+        spec_len = cpu.spec_len
+        newregs = dict(cpu.regs)
+        for (name, n, width), val in zip(regnums, replies):
+            try:
+                if len(val) == 0  and  self.p_ok:
+                    self.p_ok = False
+                    Log.write('++ no \'p\' packet support, reading registers with \'g\'\n')
+                if len(val) != width  and  len(val) > 0  and  val[0] != 'E':
+                    # the gspec doesn't match what the stub sends for this
+                    # register, don't pay for 'p' then 'g' on every stop
+                    self.p_bad.add(spec_len)
+                    Log.write('++ \'p\' %s is %d digits, not %d, using \'g\' in %d digit mode\n' %
+                                    (name, len(val), width, spec_len))
+                if len(val) != width:
+                    raise ValueError('%s is %d digits' % (name, len(val)))
+                newregs[name] = int.from_bytes(binascii.unhexlify(val), 'little')
+            except (binascii.Error, ValueError):
+                # 'p' unsupported (empty reply), an error, or the cpu mode
+                # changed the register layout: read them all with a 'g'
+                self.queue_cmd('Hg%02x' % th)
+                fut = self.queue_cmd('g', lambda: self.process_regs(th))
+                if self.stopped_thread:
+                    self.queue_cmd('Hg%02x' % self.stopped_thread)
+                return await fut
+        cpu.update(newregs, cpu.spec_len)
+        return newregs
+
     def process_mem(self):
-        parts = self.lastcmd.split(',')
-        addr = int(parts[0].strip()[1:], 16)
-        length = int(parts[1], 16)
-        st = '++ mem data 0x%x' % addr
-        for mem in Mems:
-            if mem.addr == addr:        # match data with mem panel
-                mem.update(self.rbuf, length)
-                st += '  updated!'
-        update_status(st, CPdbg)
+        # only for m cmds queued by hand, the mem windows use read_mem()
+        # and get their data through its callback
+        addr = int(self.lastcmd.split(',')[0][1:], 16)
+        update_status('++ mem data 0x%x' % addr, CPdbg)
+        return self.rbuf
+
+    def read_mem(self, addr, length, callback=None):
+        # read length bytes at addr, from the memory cache when possible.
+        # callback(data, length) and the returned future both get the
+        # bytes, or the error reply (a str) if the memory couldn't be read.
+        fut = asyncio.ensure_future(self.read_cached(addr, length))
+        if callback:
+            fut.add_done_callback(lambda fut: callback(fut.result(), length))
+        return fut
+
+    def plan_fetch(self, ranges):
+        # bring all the addr,length ranges into the cache using as few
+        # reads as possible: what is cached or already on its way is
+        # skipped, and the rest is read in runs where the needed bytes of
+        # one page run into the next (from one range or from several
+        # overlapping/touching ones).  reads don't go past the ranges,
+        # memory next to a window may not be readable.
+        cache = self.memcache
+        epoch = cache.epoch
+        need = {}                       # page: [start, end) needed
+        for addr, length in ranges:
+            end = addr + length
+            while addr < end:
+                page = addr - addr % Mem_page_size
+                e = min(end, page + Mem_page_size)
+                if page in need:
+                    need[page] = (min(need[page][0], addr), max(need[page][1], e))
+                else:
+                    need[page] = (addr, e)
+                addr = e
+        missing = [(page, s, e) for page, (s, e) in sorted(need.items())
+                                if not cache.covers(page, s, e)]
+        i = 0
+        while i < len(missing):
+            page, start, end = missing[i]
+            j = i + 1
+            while j < len(missing) and missing[j][1] == end:
+                end = missing[j][2]
+                j += 1
+            fut = self.fetch_mem(start, end - start)
+            fut.add_done_callback(lambda fut, s=start, e=end:
+                                        cache.fill(s, e, fut, epoch))
+            for page, s, e in missing[i:j]:
+                cache.fetching[page] = (start, end, fut)
+            i = j
+
+    async def read_cached(self, addr, length):
+        cache = self.memcache
+        self.plan_fetch([(addr, length)])
+        waits = {}                      # future: the [start, end) it reads
+        page = addr - addr % Mem_page_size
+        while page < addr + length:
+            if page in cache.fetching:
+                start, end, fut = cache.fetching[page]
+                waits[fut] = (start, end)
+            page += Mem_page_size
+        if len(waits) > 0:
+            await asyncio.wait(list(waits))
+        data = cache.lookup(addr, length)
+        if data == None:
+            # a read failed (or the target ran meanwhile).  if the failed
+            # read was all inside this range that's the answer, else read
+            # exactly what was asked for
+            for fut, (start, end) in waits.items():
+                if isinstance(fut.result(), str) and addr <= start and end <= addr + length:
+                    return fut.result()
+            data = await self.fetch_mem(addr, length)
+        return data
+
+    def fetch_mem(self, addr, length):
+        # read length bytes at addr as pipelined PacketSize-bounded chunks.
+        # the returned future gets the data reassembled as bytes, or the
+        # first error reply (a str) if any chunk failed.
+        fut = asyncio.get_event_loop().create_future()
+        if length <= 0:
+            fut.set_result(b'')         # no chunks, nothing would resolve it
+            return fut
+        mr = MemRead(addr, length, fut)
+        self.queue_mem_chunks(mr, addr, length)
+        return fut
+
+    def queue_mem_chunks(self, mr, addr, length):
+        # 2 hex chars per byte, leave room for $, #cs and a little slack
+        chunk = max(1, (self.packet_size - 8) // 2)
+        end = addr + length
+        while addr < end:
+            n = min(chunk, end - addr)
+            mr.pending += 1
+            self.queue_cmd('m%x,%x' % (addr, n),
+                           lambda a=addr, n=n: self.process_mem_chunk(mr, a, n))
+            addr += n
+
+    def process_mem_chunk(self, mr, addr, n):
+        mr.pending -= 1
+        data = self.rbuf
+        if len(data) % 2 or len(data) == 0:
+            # Exx (hex data is always an even length) or unsupported
+            if mr.error == None:
+                mr.error = data
+        else:
+            mr.parts[addr] = data
+            if len(data) < n * 2:
+                # the stub returned less than asked, go get the rest
+                got = len(data) // 2
+                self.queue_mem_chunks(mr, addr + got, n - got)
+        if mr.pending == 0:
+            if mr.error != None:
+                data = mr.error
+            else:
+                # the one and only hex decode of memory data
+                data = binascii.unhexlify(''.join([mr.parts[a] for a in sorted(mr.parts)]))
+            update_status('++ mem data 0x%x' % mr.addr, CPdbg)
+            mr.future.set_result(data)
+        return data
 
     def process_threadinfo(self):
         global Reorder_cpus
         if self.rbuf == 'l':
             # no more threads/cpus
-            if Reorder_cpus:            # first time?
-                reorder_cpu_panels(self.stopped_thread, self.nthreads)
-                Reorder_cpus = False
             # restore stopped thread/cpu
             # humm, self.stopped_thread can be None if user steps too fast?
             if self.stopped_thread:
                 self.queue_cmd('Hg%02x' % self.stopped_thread)
-                # FIXME if pgdb can't pick the right source file, setting
-                # active obj here will override the users source file
-                # selection and piss them off ...
-                set_active_object(Cpus[self.stopped_thread-1])
-            if Active_src:
-                Active_src.center()
-            return False        # no more thread/cpu data need to be fetched
-
-        # extract the thread number
-        th = int(self.rbuf[1:], 16)
+            self.threads_done()
+            return              # no more thread/cpu data need to be fetched
+
+        # extract the thread numbers (qemu sends one at a time)
+        for th in self.rbuf[1:].split(','):
+            self.add_thread(int(th, 16))
+        # more threads/cpus might exist
+        self.queue_cmd('qsThreadInfo')
+
+    def add_thread(self, th):
         if not th-1 in Cpus.keys():
             Cpus[th-1] = Cpu(th-1, 0)
         if not th-1 in self._threads:
             self.nthreads += 1
             self._threads.append(th-1)
         self.queue_cmd('Hg%02x' % th)
-        self.queue_cmd('g')         # re/populate regs for this cpu
-        return True                 # more threads/cpus might exist
+        # re/populate regs for this cpu
+        self.fetch_regs(th)
+
+    def threads_done(self):
+        # every thread/cpu has been found and its regs read
+        global Reorder_cpus
+        if Reorder_cpus:            # first time?
+            reorder_cpu_panels(self.stopped_thread, self.nthreads)
+            Reorder_cpus = False
+        self.follow_stop()
+
+    def follow_stop(self):
+        # make the stopped cpu active and bring the source window to it
+        if self.stopped_thread and self.stopped_thread-1 in Cpus.keys():
+            # FIXME if pgdb can't pick the right source file, setting
+            # active obj here will override the users source file
+            # selection and piss them off ...
+            set_active_object(Cpus[self.stopped_thread-1])
+        if Active_src:
+            Active_src.center()
+
+    async def read_threads(self):
+        # the whole thread list in one qXfer:threads:read transfer,
+        # ids are 'tid' or, with multiprocess extensions, 'ppid.tid'
+        doc = await self.qxfer_read('threads', '')
+        if doc == None:
+            self.xfer_threads = False
+            self.queue_cmd('qfThreadInfo')
+            return
+        for thread in search_xml(doc, 'thread'):
+            self.add_thread(int(thread['id'].split('.')[-1], 16))
+        if self.stopped_thread:
+            # the regs are all in once this is answered
+            await self.queue_cmd('Hg%02x' % self.stopped_thread)
+        self.threads_done()
 
     def process_currentthread(self):
         self.current_thread = int(self.lastcmd[2:], 16)
@@ -927,6 +1968,18 @@ class GdbClient(asyncore.dispatcher):
         self.queue_cmd(cmd)
         self.stopped_thread = None
 
+    def interrupt(self):
+        # the out-of-band ^C.  the stub stops the target and sends a stop
+        # reply, which answers the resume cmd still in flight, so the
+        # usual process_stop refresh follows.
+        if self.transport == None:
+            update_status('not connected', CPhi)
+        elif len(self.inflight) > 0 and self.inflight[0].cmd[0] in 'scv':
+            self.transport.write(b'\x03')
+            update_status('interrupt sent', CPnrm)
+        else:
+            update_status('target is not running', CPhi)
+
     def delete_breakpoints(self):
         global Breakpoints
         for bp in Breakpoints.keys():
@@ -970,30 +2023,16 @@ class GdbClient(asyncore.dispatcher):
 # pgdb.py and a few of the arch modules of their choice to a new location
 # and start running without easy-install or pypi whatever...)
 
-def ds_reconstruct_hex(data, build_list):
-    # this reconstructor operates on a hexidecimal string of data.
-    # (aka. it is tuned for gdb remote debug protocol data)
-    # bytes are encoded as [high-nibble,low-nibble] and
-    # are assembled from the lowest addres to highest address.
-    # masks here are rounded up to a multiple of 4 bits.
-    srval = ''
+def ds_reconstruct(data, build_list):
+    # this reconstructor operates on bytes of target memory (decoded
+    # once from the gdb remote debug protocol hex).  each piece is
+    # assembled little endian from the lowest address to the highest.
+    # the hex string returned is as wide as the mask.
     rval = 0
     mask = 0
     for bld in build_list:
-        val = ''
-        for byte in range(bld.firstb, bld.lastb+1):
-            val = data[byte*2:byte*2+2] + val
-        if bld.lshift % 4 != 0:
-            raise Exception('for hex reconstruction, lshift must be mult of 4')
-        try:
-            v = int(val, 16) << bld.lshift
-        except:
-            Log.write('+++ fail val=[%s]' % str(val), CPerr)
-            raise Exception('bad hex value: ' + str(val))
-        rval |= v
-        m = bld.mask << bld.lshift
-        mask |= m
-        srval = val + srval
+        rval |= int.from_bytes(data[bld.firstb:bld.lastb+1], 'little') << bld.lshift
+        mask |= bld.mask << bld.lshift
     # apply mask
     return '%0*x' % (len('%x' % mask), rval & mask), rval & mask
 
@@ -1013,47 +2052,106 @@ def ds_match_field_values(val, field_values):
             rval += fldv.txt
     return rval
 
-def ds_print_one(data, ds_spec):
-    # return a list of strings (one line each) that
-    # display 'data' according the 'ds_spec'
-    strs = []
+def ds_compile(ds_spec):
+    # build a decoder function specialized for ds_spec: the bit offsets
+    # and masks of every field, the hex width of each field (fixed by its
+    # mask) and hence all the column padding are worked out here once,
+    # instead of field by field on every record.  the decoder takes the
+    # record assembled little endian into an int and returns the lines.
+    src = ['def decode(rec):']
+    lines = []
     lno = 0
-    ln = ''
-    vals = ''
+    fmt = ''
+    col = 0             # length of the formatted line so far
+    args = []           # field value names for fmt
+    vals = []           # value text tests for this line
+    nfld = 0
+
+    def end_line():
+        ln = 'ln%d' % len(lines)
+        src.append('    %s = %r%s' % (ln, fmt, (' %% (%s,)' % ', '.join(args)) if args else ''))
+        for test, txt in vals:
+            src.append('    if %s: %s += %r' % (test, ln, txt))
+        lines.append('%s[:%d]' % (ln, ds_spec.width))
+
     for el in ds_spec.elements:
         while lno != el.y:
-            strs.append((ln + vals)[:ds_spec.width])
-            ln = ''
-            vals = ''
+            end_line()
+            fmt = ''
+            col = 0
+            args = []
+            vals = []
             lno += 1
-        ln += ' ' * (el.x - len(ln))
-        rln, val = ds_reconstruct_hex(data, el.build)
-        if not el.name.startswith('_'):
-            ln += el.name + rln
-        vals += ds_match_field_values(val, el.vals)
-    strs.append((ln + vals)[:ds_spec.width])
-    return strs
+        if el.x > col:
+            fmt += ' ' * (el.x - col)
+            col = el.x
+        named = not el.name.startswith('_')
+        if not named and not el.vals:
+            continue
+        mask = 0
+        for bld in el.build:
+            mask |= bld.mask << bld.lshift
+        pieces = []
+        for bld in el.build:
+            bmask = ((1 << 8 * (bld.lastb - bld.firstb + 1)) - 1) & (mask >> bld.lshift)
+            pieces.append('(rec >> %d & 0x%x) << %d' % (8 * bld.firstb, bmask, bld.lshift))
+        v = 'v%d' % nfld
+        nfld += 1
+        src.append('    %s = %s' % (v, ' | '.join(pieces) or '0'))
+        if named:
+            w = len('%x' % mask)
+            fmt += el.name.replace('%', '%%') + '%%0%dx' % w
+            col += len(el.name) + w
+            args.append(v)
+        for fldv in el.vals:
+            if fldv.val == -1:
+                vals.append(('%s != 0' % v, fldv.txt))
+            else:
+                vals.append(('%s & 0x%x == 0x%x' % (v, fldv.mask, fldv.val), fldv.txt))
+    end_line()
+    src.append('    return [%s]' % ', '.join(lines))
+
+    ns = {}
+    exec(compile('\n'.join(src), '<ds %s>' % ds_spec.name, 'exec'), ns)
+    return ns['decode']
+
+def ds_code(ds_spec):
+    # compiled decoder for ds_spec, built on first use if load_arch_module
+    # didn't get to it
+    code = getattr(ds_spec, 'code', None)
+    if code == None:
+        code = ds_spec.code = ds_compile(ds_spec)
+    return code
+
+def ds_print_one(data, ds_spec):
+    # return a list of strings (one line each) that
+    # display 'data' according the 'ds_spec'
+    return ds_code(ds_spec)(int.from_bytes(data, 'little'))
 
 def ds_print(data, ds_spec, start_addr):
-    # 'data' is a gdb rdp mem dump string of nibbles (see above)
+    # 'data' is the bytes of a gdb rdp mem dump, an array of ds_spec
+    # records decoded in one pass with the compiled decoder
     strs = []
-    data_offset = 0     # in bytes
-    while data_offset*2 < len(data):
-        # if struct is multi-line, add a full line for the header
-        if ds_spec.height > 1 and ds_spec.header:
-            strs.append(ds_spec.header % (start_addr + data_offset))
-        # break data into struct size chunks
-        chunk = data[data_offset*2:(data_offset+ds_spec.dlen)*2]
-        for ln in ds_print_one(chunk, ds_spec):
-            # if struct is single-line, header goes in the left margin
-            if ds_spec.height == 1 and ds_spec.header:
-                ln = ds_spec.header % (start_addr + data_offset) + ln
-            strs.append(ln)
-        data_offset += ds_spec.dlen
+    decode = ds_code(ds_spec)
+    dlen = ds_spec.dlen
+    hdr = ds_spec.header
+    multi = ds_spec.height > 1
+    for data_offset in range(0, len(data), dlen):
+        lns = decode(int.from_bytes(data[data_offset:data_offset+dlen], 'little'))
+        if hdr:
+            h = hdr % (start_addr + data_offset)
+            if multi:
+                # if struct is multi-line, add a full line for the header
+                strs.append(h)
+            else:
+                # if struct is single-line, header goes in the left margin
+                lns = [h + ln for ln in lns]
+        strs.extend(lns)
     return strs
 
-DSfns = {'ds_reconstruct_hex':    ds_reconstruct_hex,
+DSfns = {'ds_reconstruct':        ds_reconstruct,
          'ds_match_field_values': ds_match_field_values,
+         'ds_compile':            ds_compile,
          'ds_print_one':          ds_print_one,
          'ds_print':              ds_print}
 
@@ -1063,6 +2161,8 @@ DSfns = {'ds_reconstruct_hex':    ds_reconstruct_hex,
 # easier to blacklist non-opcode keywords than whitelist opcodes ...
 # only need to list the nasm non-opcode keywords that create data.
 Non_opcode_keywords = ['db', 'dw', 'dd', 'dq', 'times', 'align']
+# the words Src.line_parse() looks for, to skip decoding mapped lines
+Line_parse_hint = re.compile(rb'(?i)section|org|global|file format elf')
 
 # ----------------------------------------------------------------------------
 # curses TUI support
@@ -1077,6 +2177,7 @@ Recent_src   = []       # source window stickiness
 Pin_source   = False    # True if user has pinned a source window
 Nextip       = None     # updated when source window scrolls to highlighted ip
 Log          = None
+Stats        = None     # the rdp stats panel
 
 Reorder_cpus = True     # True = need to reorder cpu panels
                         # (will occur at end of next qThreadInfo cmd chain)
@@ -1216,6 +2317,7 @@ def set_active_object(newobj):
     Active_obj.panel.top()
     if isinstance(newobj, Cpu):
         Active_cpu = newobj
+        Gdbc.activated_cpu(newobj)
         newobj.locate()
     if isinstance(newobj, Mem):
         Active_mem = newobj
@@ -1238,6 +2340,8 @@ def rotate_active_object():
     if Active_obj:
         Active_obj.activate_title()
         update_status(Active_obj.title, CPnrm)
+        if isinstance(Active_obj, Cpu):
+            Gdbc.activated_cpu(Active_obj)
         #Stdscr.addstr(31,0, str('new ' + Active_obj.title).encode('ascii'))
     else:
         update_status('no active window', CPnrm)
@@ -1291,11 +2395,126 @@ def set_watchpoint(text):
         update_status('++ setting %s' % cmd, CPdbg)
         Gdbc.queue_cmd(cmd)
 
+class SymTable(object):
+    # an index over the code and data symbols of every loaded listing and
+    # map file: sorted by offset for each segment and each source file, for
+    # nearest-symbol-below lookups, and by name.  loading only ever appends
+    # to the Src symbol lists, so the index is rebuilt at the next lookup
+    # after their lengths change.
+    def __init__(self):
+        self.nsyms = None
+        self.offsets = {}       # {(kind, seg, src): array of sorted offsets}
+        self.syms = {}          # {(kind, seg, src): [(sym, src)] in the same order}
+        self.names = {}         # {name: [(kind, sym, src)] in load order}
+
+    def refresh(self):
+        nsyms = [(len(src.codesyms), len(src.datasyms)) for src in Srcs]
+        if nsyms == self.nsyms:
+            return
+        self.nsyms = nsyms
+        self.offsets = {}
+        self.syms = {}
+        self.names = {}
+        for src in Srcs:
+            for kind, table in [('code', src.codesyms), ('data', src.datasyms)]:
+                for sym in table:
+                    name, offset, segments, fixup = sym
+                    self.names.setdefault(name, []).append((kind, sym, src))
+                    # a seg or src of None indexes all segments or all files
+                    for seg in [None] + list(set(segments or [])):
+                        for s in [None, src]:
+                            self.syms.setdefault((kind, seg, s), []).append((sym, src))
+        for key, lst in self.syms.items():
+            # sort is stable, equal offsets stay in load order
+            lst.sort(key=lambda e: e[0][1])
+            self.offsets[key] = array.array('Q', [e[0][1] for e in lst])
+
+    def below(self, ip, seg=None, src=None, kind='code'):
+        # the symbol at or nearest below ip as (sym, src),
+        # the last one loaded if several share that offset
+        self.refresh()
+        offsets = self.offsets.get((kind, seg, src))
+        if not offsets:
+            return None
+        i = bisect.bisect_right(offsets, ip)
+        if i == 0:
+            return None
+        return self.syms[(kind, seg, src)][i-1]
+
+    def lookup(self, name, src=None, kind='code'):
+        # the first symbol loaded with this name as (sym, src)
+        self.refresh()
+        for k, sym, s in self.names.get(name, []):
+            if k == kind and (src == None or s == src):
+                return sym, s
+        return None
+
+Symbols = SymTable()
+
+class SrcRanges(object):
+    # which Srcs list code at an address: for each segment, the sorted
+    # boundaries of all the Srcs' code ranges and, for each span starting
+    # at a boundary, the Srcs (in load order) that cover it.  rebuilt at
+    # the next lookup after Srcs or their ranges change, like SymTable.
+    def __init__(self):
+        self.key = None
+        self.bounds = {}        # {seg: array of sorted range boundaries}
+        self.covers = {}        # {seg: [[src, ...] for each boundary]}
+
+    def refresh(self):
+        key = [(src.offset, len(src.ranges), len(src.ip_addrs)) for src in Srcs]
+        if key == self.key:
+            return
+        self.key = key
+        ranges = {}
+        for src in Srcs:
+            if len(src.ip_addrs) == 0:
+                continue            # a missing listing can't show the ip
+            for seg in set(src.segments or []):
+                for start, end in src.code_ranges():
+                    ranges.setdefault(seg, []).append((start, end, src))
+        order = dict((src, i) for i, src in enumerate(Srcs))
+        self.bounds = {}
+        self.covers = {}
+        for seg, lst in ranges.items():
+            # one sweep up the boundaries, tracking the open ranges
+            starts = {}
+            ends = {}
+            for start, end, src in lst:
+                if start < end:
+                    starts.setdefault(start, []).append(src)
+                    ends.setdefault(end, []).append(src)
+            bounds = sorted(set(starts) | set(ends))
+            active = {}             # {src: number of its ranges open}
+            covers = []
+            for b in bounds:
+                for src in ends.get(b, []):
+                    active[src] -= 1
+                    if active[src] == 0:
+                        del active[src]
+                for src in starts.get(b, []):
+                    active[src] = active.get(src, 0) + 1
+                covers.append(sorted(active, key=order.get))
+            self.bounds[seg] = array.array('Q', bounds)
+            self.covers[seg] = covers
+
+    def lookup(self, seg, ip):
+        # the Srcs with code at seg:ip
+        self.refresh()
+        bounds = self.bounds.get(seg)
+        if not bounds:
+            return []
+        i = bisect.bisect_right(bounds, ip) - 1
+        if i < 0:
+            return []
+        return self.covers[seg][i]
+
+Src_ranges = SrcRanges()
+
 def lookup_fixup(label, src):
-    for name, offset, segments, fixup in src.codesyms:
-        if name == label:
-        # and len(set(segments).intersection(set(srcwin.segments))) > 0:
-            return fixup #offset
+    found = Symbols.lookup(label, src)
+    if found:
+        return found[0][3]      # fixup (not offset)
     return None
 
 def dictify_symbols(table):
@@ -1306,33 +2525,30 @@ def dictify_symbols(table):
         rval[name] = offset
     return rval
 
-# Ok so this is likely the messiest and fuzziest bit of code here.
 # locate_src() is supposed to guess which source file/window best
-# matches the current cpu's ip.  It would be deterministic if I didn't
-# want it to also support overlapping address spaces (either as multiple
+# matches the current cpu's ip.  It would be simple if it didn't also
+# have to support overlapping address spaces (either as multiple
 # tasks all running in containers that appear identical from the
 # inside, or as overlays).
 #
-# I've made some good improvements since 0.06 and it works better
-# but it has become less maintainable.  I know *how* I want to
-# re-write it all but it will have to wait a couple weeks until I
-# can find some time (today = Nov 5, 2015)
-#
-# What needs to happen is for source selection to follow this set of
-# priorities (the exising code doesn't follow them correctly yet).
+# The candidates are the source files whose code ranges (from the map
+# file sections, else the addresses in the listing) hold the ip, found
+# with Src_ranges.  Those that actually list a line at the ip are
+# preferred, a range can span code a file doesn't list.  Source
+# selection then follows this set of priorities, with load order as
+# the final tie-breaker so the same state always picks the same file.
 #
 #       1. If the cpu architecture is segmented, then the assigned
 #          segments for each source file (on the command line for now)
 #          must match the segment being used by the cpu.
 #
-#       2. If there is only one source file with a base offset below
+#       2. If there is only one source file whose code ranges hold
 #          the current ip, then switch to it regardless.
 #
 #       Else an intellegent choice needs to be made that honors any
 #       overrides implied by the user - to do this the remaining
 #       priorities should be as follows.  From a list of candidate
-#       source files (in which an exact match for the current ip can
-#       be found):
+#       source files (whose code ranges hold the current ip):
 #
 #       3. If the candidate list length == 1, switch to that source
 #          file regardless.
@@ -1348,6 +2564,9 @@ def dictify_symbols(table):
 #          forth on each single-step).
 #
 #       7. Favor a source file we've seen before.
+#
+# (for 5, a file with a code label right at the ip is taken to be
+# the one we just entered, rule 6 then keeps us there)
 
 def locate_src(seg, ip):
     global Active_src, Pin_source
@@ -1359,107 +2578,23 @@ def locate_src(seg, ip):
         Active_src.ip_search(ip)
         return
 
-    best_offset = None
-    best_src = None
-    best_idx = None
-    dbg = 'locating %x:%08x\n' % (seg, ip)
-    if hasattr(Active_src, 'fname'):
-        dbg += 'active src %s\n' % os.path.basename(Active_src.fname)
-        dbg += 'recent %s\n' % str(
-                        [os.path.basename(src.fname) for src in Recent_src])
-        dbg += 'all %s\n' % str(
-                    [os.path.basename(src.fname) for src in Srcs])
-    n = 0
-    # next, see if any src files have a starting offset that is below our ip
-    src_candidates = []
-    for src in Srcs:
-        dbg += '%16s seg{%s,%d}  ' % (os.path.basename(src.fname), str(src.segments), seg)
-        if src.segments and seg in src.segments:
-            dbg += 'ip{%x,%x}  ' % (src.offset, ip)
-
-            # FIXME  Ok, heres where it gets fuzzy.  What algorithm should
-            # be used to pick the best candidate?  This has evolved over time
-            # but still makes mistakes.  It is probably best fixed by introducing
-            # some other mechanism to group source files ... on the command line
-            # (or group all source files refed by a map file! duh.)
-
-            # an exact ip match is favored over other
-            if src.offset == ip:
-                best_src = src
-                best_offset = src.offset
-                dbg += '\n'
-
-            # choose src with the nearest base offset just below our ip
-            elif src.offset < ip:
-                # if the ip can't be matched, it's not a good candidate 
-                if not src.ip_search(ip):
-                    dbg += '\nip not found in %s\n' % os.path.basename(src.fname)
-                    continue
-                src_candidates.append(src)
-                n += 1
-                dbg += 'candidate %s' % os.path.basename(src.fname)
-
-                # the active source window is favored over other candidates
-                if src == Active_src:
-                    best_src = src
-                    best_offset = src.offset
-                    dbg += '\n'
-
-                # recent source files favored over new ones
-                elif src in Recent_src:
-                    new_idx = Recent_src.index(src)
-                    if best_idx == None or new_idx < best_idx:
-                        best_src = src
-                        best_offset = src.offset
-                        best_idx = new_idx
-                # lastly, favor the nearest base offset to the ip
-                elif best_idx == None \
-                and (not best_offset or src.offset >= best_offset):
-                    best_offset = src.offset
-                    best_src = src
-        dbg += '\n'
-    dbg += 'cands are %s\n' % str(
-                    [os.path.basename(src.fname) for src in src_candidates])
+    cands = Src_ranges.lookup(seg, ip)
+    best_src = pick_src(cands, seg, ip)
+    #Log.write('locating %x:%08x cands %s best %s\n' % (seg, ip,        # DEBUG
+    #          str([os.path.basename(src.fname) for src in cands]),
+    #          best_src and os.path.basename(best_src.fname)), CPdbg)
+
     if best_src:
-        dbg += 'best %s\n' % str(os.path.basename(best_src.fname))
-        # next, if we have a best candidate, look for a code address
-        # that is as close to the ip as possible but still below
-        for name, off, segs, base in best_src.codesyms:
-            if seg in segs and off <= ip:
-                if not best_offset or off >= best_offset:
-                    best_offset = off
-                    dbg += 'best now lbl=%s [%s]\n' % (name,
-                                        os.path.basename(best_src.fname))
-    else:
-        # last, within the list of src candidates, look for a code address
-        # that is as close to the ip as possible but still below
-        for src in src_candidates:
-            for name, off, segs, base in src.codesyms:
-                if seg in segs and off <= ip:
-                    if not best_offset or off >= best_offset:
-                        best_offset = off
-                        best_src = src
-                        dbg += 'best now lbl=%s in %s\n' % (name,
-                                            os.path.basename(src.fname))
-
-    # so yeah the nearest-symbol lookup code is disappointingly dense,
-    # but this next Log.write dbg statement is really useful for debugging
-    # it all ...
-    #Log.write(dbg, CPdbg)              # DEBUG
-
-    # assuming the offset will never be 0
-    if best_offset:
         # if we only have one candidate, switch to it.
         # if we have more but the user has one pinned, don't switch.
         # else do the switch.
-        if n == 1 or not Pin_source:
+        if len(cands) == 1 or not Pin_source:
             if Pin_source:
                 Log.write('source window unpinned\n')
                 Pin_source = False
                 update_status()
             Active_src = best_src
             Active_src.center()
-            #DEBUG Log.write('auto pick %s\n' % best_src.fname)
     else:
         # no source file seems to describe where ip is,
         # how about a generic disassembly Background panel as a default?
@@ -1469,6 +2604,39 @@ def locate_src(seg, ip):
     if Active_src:
         Active_src.ip_search(ip)
 
+def pick_src(cands, seg, ip):
+    # apply priorities 3 through 7 above to the candidate source files,
+    # those with a line at ip if there are any
+    listed = [src for src in cands if src.lists_ip(ip)]
+    if listed:
+        cands = listed
+    if len(cands) < 2:
+        return cands[0] if cands else None
+    # 5. files with a label at ip
+    entered = []
+    for src in cands:
+        found = Symbols.below(ip, seg, src)
+        if found and found[0][1] == ip:
+            entered.append(src)
+    if entered:
+        cands = entered
+    # 6. the active file (4, a pinned one, never gets this far)
+    if Active_src in cands:
+        return Active_src
+    # 7. the file used most recently
+    for src in Recent_src:
+        if src in cands:
+            return src
+    # else the code range starting nearest below ip, then load order
+    best_src = None
+    best_start = None
+    for src in cands:
+        start = max([s for s, e in src.code_ranges() if s <= ip < e])
+        if best_start == None or start > best_start:
+            best_start = start
+            best_src = src
+    return best_src
+
 
 def match_src_file(fname, segs):
     # prevents duplicate loads of source files
@@ -1586,6 +2754,18 @@ class Movable_panel(object):
         del self
 
 
+class RegsSeen(dict):
+    # a register dict that remembers which registers were read from it,
+    # ie. the ones the arch module displays or needs.  -regfetch p reads
+    # only these.
+    def __init__(self, *args):
+        dict.__init__(self, *args)
+        self.seen = set()
+
+    def __getitem__(self, key):
+        self.seen.add(key)
+        return dict.__getitem__(self, key)
+
 class Cpu(Movable_panel):
     def __init__(self, i, spec_len):
         global Active_cpu, Active_obj
@@ -1598,7 +2778,8 @@ class Cpu(Movable_panel):
             self.mode = None
         Movable_panel.__init__(self, y,x, i+2,i*3+4, ' cpu%d ' % i)
         self.i = i
-        self.regs = {}          # register values are integers
+        self.regs = RegsSeen()  # register values are integers
+        self.spec_len = None    # the Arch.spec key of the last regs update
         self.last_ip = None
 
     def update(self, newregs, mode):
@@ -1618,12 +2799,18 @@ class Cpu(Movable_panel):
 
         # get all the register display strings
         # (not just the ones currently displayed)
+        # and note which registers the arch module looks at
+        if self.spec_len != mode:
+            self.regs.seen.clear()
+        newregs = RegsSeen(newregs)
         strs = Arch.cpu_reg_update(self, newregs, mode)
+        self.regs.seen |= newregs.seen
         self.add_strs(strs, CPnrm)
 
         # update regs
         for key, val in newregs.items():
             self.regs[key] = val
+        self.spec_len = mode
 
         if self == Active_cpu:
             self.locate()
@@ -1639,6 +2826,22 @@ class Cpu(Movable_panel):
     def scroll(self, kname):
         pass
 
+def refetch_mems():
+    # plan the reads for all the windows together so overlapping and
+    # adjacent windows share them, then each window takes its slice
+    Gdbc.plan_fetch([(mem.addr, mem.length) for mem in Mems])
+    for mem in Mems:
+        mem.refetch()
+
+def fetch_mem_panel(mem):
+    # read the whole window, however many packets that takes.  the data is
+    # dropped if the window has moved or been closed in the meantime.
+    addr = mem.addr
+    def fetched(data, length):
+        if mem in Mems and mem.addr == addr:
+            mem.update(data, length)
+    Gdbc.read_mem(addr, mem.length, fetched)
+
 class Mem(Movable_panel):
     def __init__(self, i, addr, count):
         # addr needs to be an int.
@@ -1656,17 +2859,18 @@ class Mem(Movable_panel):
                                Gdbc.nthreads+8+i*3,w-self.w-2, ' mem%d ' % i)
         self.i = i
         self.addr = addr
-        self._mkcmd()
+        self._set_length()
         Active_mem = self
         self.refetch()
 
-    def _mkcmd(self):
-        self.cmd = 'm%x,%x' % (self.addr, self.count)
+    def _set_length(self):
+        # bytes refetch() reads, refetch_mems() plans the packets
+        self.length = self.count
         self.lines = None
 
     def update(self, data, length):
         # called by Gdbc when data returns, NOT by keyboard or curses events.
-        if data == "E14":
+        if isinstance(data, str):       # an Exx error reply
             self.win.addstr(2, 1, "  page fault: part of [%x-%x] memory is not accessible  " % (
                                     self.addr, self.addr+length), CPerr)
         else:
@@ -1687,13 +2891,13 @@ class Mem(Movable_panel):
 
     def refetch(self):
         # initiate mem data read
-        Gdbc.queue_cmd(self.cmd)
+        fetch_mem_panel(self)
 
     def scroll(self, kname):
         # don't scroll, instead move the address up/down half a window
         if   kname == CTRL_PAGEU: self.addr -= int(self.count/2)
         elif kname == CTRL_PAGED: self.addr += int(self.count/2)
-        self._mkcmd()
+        self._set_length()
         self.refetch()
 
     def kill(self):
@@ -1719,17 +2923,17 @@ class Mem_ds(Movable_panel):
                                ' mem%d %s ' % (i, ds_spec.name))
         self.i = i
         self.addr = addr
-        self._mkcmd()
+        self._set_length()
         Active_mem = self
         self.refetch()
 
-    def _mkcmd(self):
-        self.cmd = 'm%x,%x' % (self.addr, self.count * self.ds_spec.dlen)
+    def _set_length(self):
+        self.length = self.count * self.ds_spec.dlen
         self.lines = None
 
     def update(self, data, length):
         # called by Gdbc when data returns, NOT by keyboard or curses events.
-        if data == "E14":
+        if isinstance(data, str):       # an Exx error reply
             self.win.addstr(2, 1, "  page fault: part of [%x-%x] " % (
                                     self.addr, self.addr+length), CPerr)
             self.win.addstr(2, 2, "  memory is not accessible  ", CPerr)
@@ -1755,7 +2959,7 @@ class Mem_ds(Movable_panel):
 
     def refetch(self):
         # initiate mem data read
-        Gdbc.queue_cmd(self.cmd)
+        fetch_mem_panel(self)
 
     def scroll(self, kname):
         pass
@@ -1823,6 +3027,47 @@ class Help(Movable_panel):
         self.subwin = self.win.derwin(h,w, 0,1)
         self.subwin.addstr(1, 1, self.text, CPnrm)
 
+class Statistics(Movable_panel):
+    # per rdp command kind counts, bytes and latencies (see PacketStats)
+    def __init__(self):
+        self.h = 14
+        self.w = 77
+        sh,sw = Stdscr.getmaxyx()
+        Movable_panel.__init__(self, self.h+2,self.w+2, 1,sw-self.w-2, ' rdp stats ')
+        self.timer = None
+        self.hide()
+
+    def update_soon(self):
+        # a stop brings a burst of replies, redraw once they're in
+        if self.timer == None:
+            self.timer = asyncio.get_event_loop().call_later(
+                                Stats_refresh_delay, self.timed_update)
+
+    def timed_update(self):
+        self.timer = None
+        if self.visible:
+            self.update()
+            refresh_all()
+
+    def update(self):
+        lines = stats_report(Gdbc.stats)
+        if len(lines) > self.h:
+            lines = lines[:self.h]
+        self.win.move(1, 0)
+        self.win.clrtobot()
+        self.win.attron(CPbdr)
+        self.win.box()
+        self.win.attroff(CPbdr)
+        self.win.addstr(0, 1, self.title, CPtitle0)
+        for i, ln in enumerate(lines):
+            self.win.addstr(i+1, 1, ln, CPhi if i == 0 else CPnrm)
+
+    def toggle(self):
+        Movable_panel.toggle(self)
+        if self.visible:
+            self.rise()
+            self.update()
+
 
 class Background_panel(object):
     # Background panels:
@@ -1838,9 +3083,14 @@ class Background_panel(object):
     # The focus point will move only if stdscr is resized.
     # The pad display point moves when the user scrolls a background_panel
     # based object.
+    #
+    # The pad is only virtual: the lines with extra_yx blank lines above
+    # and columns to the right.  draw() renders just the part of it that
+    # is on the screen, so a huge listing costs no more than a small one.
 
     def __init__(self):
-        self.pad = None
+        self.pad = None         # screen sized, see draw()
+        self.lines = []
         self.pady = 0           # pad display origin
         self.padx = 0
         self.maxy = 0
@@ -1859,23 +3109,27 @@ class Background_panel(object):
         sh,sw = Stdscr.getmaxyx()
         return sh, sw, sh // 4 * 3, sw // 4
 
-    def make_pad(self, lines, cols):
+    def set_lines(self, lines, cols):
+        # the lines to display, cols is the longest one
+        self.lines = lines
         self.maxy = len(lines)
         self.maxx = cols
-        # win.overlay(destscr, sy, sx, dy, dx, dh, dw) and win.overwrite()
-        # can't handle negative sy,sx values, nor do they handle sy,sx values
-        # that extend beyond the pad (libncursesw.so.5.9 tends to dump core).
-        # So, add blank lines and columns to the top, bottom, and right
-        # sides of pad so the focus point can center on a line at the top or
-        # bottom of the source file.
+
+    def draw(self, sh, sw):
+        # render the screen's worth of the virtual pad at the display origin
+        # into self.pad.  above the first line are blank source rows, below
+        # the last line the pad is left empty.
         ey,ex = self.extra_yx
-        self.pad = curses.newpad(self.maxy + ey*2 +1, cols + ex +1)
-        self.pad.attron(CPsrc)
-        fmt = '%-*s' + ' '*ex + '\n'
-        for i in range(ey):
-            self.pad.addstr(fmt % (cols, ' '))
-        for ln in lines:
-            self.pad.addstr(fmt % (cols, ln))
+        if self.pad == None or self.pad.getmaxyx() != (sh-1, sw+1):
+            # (the extra column keeps addstr off the bottom right corner)
+            self.pad = curses.newpad(sh-1, sw+1)
+        self.pad.erase()
+        for i in range(sh-1):
+            lno = self.pady + i - ey
+            if lno >= self.maxy:
+                break
+            ln = self.lines[lno][self.padx:self.padx+sw] if lno >= 0 else ''
+            self.pad.addstr(i, 0, '%-*s' % (sw, ln), CPsrc)
 
     def show(self):
         pass
@@ -1917,7 +3171,8 @@ class Background_panel(object):
 
         # completely rewrite the pad over stdscr.
         # 1,0 protects the prompt line at the top of stdscr
-        self.pad.overwrite(Stdscr, y,x, 1,0, sh-1,sw-1)
+        self.draw(sh, sw)
+        self.pad.overwrite(Stdscr, 0,0, 1,0, sh-1,sw-1)
 
     def scroll(self, kname):
         h,w = Stdscr.getmaxyx()
@@ -1933,6 +3188,88 @@ class Background_panel(object):
         elif kname == KEY_END:    y  = self.maxy + self.extra_yx[0]
         self.center(y, x)
 
+def src_line(ln):
+    # remove the newline and trailing whitespace,
+    # and tabs (ncurses can't deal with them)
+    return ln.rstrip().replace('\t', ' ')
+
+class MappedLines(object):
+    # the lines of a listing left in the file (-mmap): only an array of
+    # line start offsets is kept and each line is decoded when it is read,
+    # which is when it's drawn or searched.  lines that are assigned to
+    # are kept in self.changed.
+    #
+    # reading a mapping past the end of a file that has since been cut
+    # short kills the process (SIGBUS), and listings get rebuilt while
+    # pgdb runs.  so every read first checks the file's size and mtime,
+    # and once the file has changed the map isn't touched again.
+    def __init__(self, fname):
+        self.fname = fname
+        self.fd = os.open(fname, os.O_RDONLY)
+        st = os.fstat(self.fd)
+        self.stamp = (st.st_size, st.st_mtime_ns)
+        self.mm = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        self.changed = {}
+        # the line start offsets in one pass, then one past the end of
+        # the last line's newline (real or not)
+        self.offsets = array.array('Q', [0])
+        self.offsets.extend(m.end() for m in re.finditer(b'\n', self.mm))
+        if self.mm[-1:] != b'\n':
+            self.offsets.append(len(self.mm) + 1)
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+            os.close(self.fd)
+            self.mm = None
+
+    def __del__(self):
+        self.close()
+
+    def mapped(self):
+        # False once the file has changed under the map
+        if self.mm:
+            st = os.fstat(self.fd)
+            if (st.st_size, st.st_mtime_ns) != self.stamp:
+                Log.write('%s changed on disk, restart pgdb to see it\n' %
+                                    os.path.basename(self.fname), CPhi)
+                self.close()
+        return self.mm != None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, i):
+        # line i as bytes, with src_line()'s cleanup, not decoded
+        ln = self.mm[self.offsets[i]:self.offsets[i+1]-1]
+        return ln.rstrip().replace(b'\t', b' ')
+
+    def raw_lines(self):
+        if not self.mapped():
+            return
+        for i in range(len(self)):
+            yield self.raw(i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i in self.changed:
+            return self.changed[i]
+        if i < 0 or i >= len(self):
+            raise IndexError('line %d out of range' % i)
+        if not self.mapped():
+            return ''
+        return self.raw(i).decode(errors='replace')
+
+    def __setitem__(self, i, ln):
+        if i < 0:
+            i += len(self)
+        self.changed[i] = ln
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 # Prioritized hilite types (lowest to highest)
 # TODO: there will be multiple breakpoints
 # the hilite list needs to grow dynamically ...
@@ -1962,35 +3299,47 @@ class Src(Background_panel):
         # ints are used for segment and offset to simplify comparisons
         self.segments = segments    # text segment selectors or frame addresses
         self.offset = offset        # text segment offset address (int)
+        self.ranges = []            # [(start, end)] code addresses, from map files
+        # address -> line index, sorted by address then line number.
+        # addresses are as listed (before self.offset or a fixup is added)
+        self.ip_addrs = array.array('Q')
+        self.ip_lines = array.array('L')
+        # the lines read_nextip_at_or_after_focus_point() can pick, in order
+        self.nip_lines = array.array('L')
+        self.nip_addrs = []         # the address text on each of those lines
+        self.label_lines = array.array('L')     # objdump '<label>:' lines
+        self.label_names = []
+        self.labels = {}            # objdump label: its first line
 
         Srcs.append(self)
 
         if file_exists(fname, self.lines):
-            # determine needed source panel height and width,
-            # and store the source
+            # store the source, and determine needed source panel
+            # height and width
+            if Mmap_listings and os.path.getsize(self.fname) > 0:
+                self.lines = MappedLines(self.fname)
+            else:
+                with open(self.fname) as fh:
+                    self.lines = [src_line(ln) for ln in fh.readlines()]
             cols = 0
-            with open(self.fname) as fh:
-                for ln in fh.readlines():
-                    ln = ln.rstrip()    # remove newline and whitespace
-                    # ncurses can't deal with tabs
-                    ln = ln.replace('\t', ' ')
-                    l = len(ln)
-                    if l > cols: cols = l
-                    self.lines.append(ln)
-                    # do per-line parsing - may find the text segment base
-                    # address for this file, or may find text symbols,
-                    # these override seg:off values passed in.
-                    self.line_parse(ln)
-
-                # remove blanks lines at the end of the file
-                #while len(self.lines[-1]) == 0:
-                if len(self.lines[-1]) == 0:
-                    self.lines[-1] = '-blank-'
+            for ln in self.text_lines():
+                l = len(ln)
+                if l > cols: cols = l
+                # do per-line parsing - may find the text segment base
+                # address for this file, or may find text symbols,
+                # these override seg:off values passed in.
+                self.line_parse(ln)
+
+            # remove blanks lines at the end of the file
+            #while len(self.lines[-1]) == 0:
+            if len(self.lines[-1]) == 0:
+                self.lines[-1] = '-blank-'
+            self.index_lines()
             #Log.write('+++ parsed %s as %s\n' % (fname, self.ftype))
         else:
             cols = len(self.lines[0])
 
-        self.make_pad(self.lines, cols)
+        self.set_lines(self.lines, cols)
 
         fname = os.path.basename(fname)
         if self.offset == None:
@@ -2012,10 +3361,25 @@ class Src(Background_panel):
             Active_src = self
             self.center()
 
+    def text_lines(self):
+        # the lines to parse and index: bytes for a mapped listing, so
+        # loading doesn't decode every line, drawing decodes the few shown
+        if isinstance(self.lines, MappedLines):
+            return self.lines.raw_lines()
+        return self.lines
+
+    def close(self):
+        if isinstance(self.lines, MappedLines):
+            self.lines.close()
+
     def line_parse(self, ln):
+        if isinstance(ln, bytes):
+            if not Line_parse_hint.search(ln):
+                return
+            ln = ln.decode(errors='replace')
         if self.ftype == 'nasmlst':
             # if its a nasm .lst file, look for 'section .text start='
-            mobj = re.search('section\s*.text\s*start=0x[0-9a-f]+', ln, re.I)
+            mobj = re.search(r'section\s*.text\s*start=0x[0-9a-f]+', ln, re.I)
             if mobj:
                 if not self.segments:
                     self.segments = [0]
@@ -2023,7 +3387,7 @@ class Src(Background_panel):
                     self.offset = int(mobj.group().split('=')[-1].strip(), 16)
                 return
             # or 'org'
-            mobj = re.search('org\s*0x[0-9a-f]+', ln, re.I)
+            mobj = re.search(r'org\s*0x[0-9a-f]+', ln, re.I)
             if mobj:
                 if not self.segments:
                     self.segments = [0]
@@ -2031,7 +3395,7 @@ class Src(Background_panel):
                     self.offset = int(mobj.group().split()[1].strip(), 16)
                 return
             # or just 'section .text' in which case assume offset 0
-            mobj = re.search('section\s*.text+', ln, re.I)
+            mobj = re.search(r'section\s*.text+', ln, re.I)
             if mobj:
                 if not self.segments:
                     self.segments = [0]
@@ -2048,11 +3412,102 @@ class Src(Background_panel):
             if re_objdump:
                 self.ftype = 'objdump'
                 return
-            re_nasmlst = re.search('global *[\w]', ln)
+            re_nasmlst = re.search(r'global *[\w]', ln)
             if re_nasmlst:
                 self.ftype = 'nasmlst'
                 return
 
+    def code_ranges(self):
+        # the [start, end) code address ranges given by a map file,
+        # else the span of the addresses listed in the file
+        if self.ranges:
+            return self.ranges
+        if len(self.ip_addrs) == 0:
+            return []
+        return [(self.offset + self.ip_addrs[0], self.offset + self.ip_addrs[-1] + 1)]
+
+    def index_lines(self):
+        # index the listing by address once, here, so that following the ip
+        # doesn't mean a text search through the whole file at every step.
+        # a mapped listing is indexed from its bytes, only the pieces kept
+        # are decoded.
+        ips = []
+        raw = isinstance(self.lines, MappedLines)
+        txt = (lambda b: b.decode(errors='replace')) if raw else (lambda s: s)
+        sp, colon, nothing = (b' ', b':', b'') if raw else (' ', ':', '')
+        re_addr = re.compile(rb' *([0-9a-f]+): ' if raw else r' *([0-9a-f]+): ')
+        re_label = re.compile(rb'[0-9a-f]* <([\w_]*)>:' if raw else r'[0-9a-f]* <([\w_]*)>:')
+        for l, ln in enumerate(self.text_lines()):
+            if self.ftype == 'nasmlst':
+                # line number, then 8 hex digits of address
+                ip = txt(ln[7:15])
+                if not ishexdigit(ip):
+                    continue
+                if ln[6:7] == sp  and  ln[15:16] in [nothing, sp]:
+                    ips.append((int(ip, 16), l))
+                # only lines that generate code are next ip candidates
+                if len(ln) < 40:
+                    continue
+                keywords = [txt(k) for k in ln[40:].split()[:3]]
+                if len(keywords) == 0 \
+                or len(set(keywords).intersection(set(Non_opcode_keywords))) > 0:
+                    continue
+                self.nip_lines.append(l)
+                self.nip_addrs.append(ip)
+            elif self.ftype == 'objdump':
+                mobj = re_addr.match(ln)
+                if mobj:
+                    ips.append((int(mobj.group(1), 16), l))
+                    # precarious! depending on objdump to always print
+                    # offsets with a colon in the 4th column :O
+                    if len(ln) >= 5 and ln[4:5] == colon and hexchk(ln[0:4]):
+                        self.nip_lines.append(l)
+                        self.nip_addrs.append(txt(ln[0:4]).strip())
+                    continue
+                mobj = re_label.search(ln)
+                if mobj:
+                    label = txt(mobj.group(1))
+                    self.label_lines.append(l)
+                    self.label_names.append(label)
+                    if not label in self.labels:
+                        self.labels[label] = l
+        ips.sort()
+        self.ip_addrs.extend([a for a, l in ips])
+        self.ip_lines.extend([l for a, l in ips])
+
+    def ip_line(self, addr, after=0):
+        # the first line at or after line 'after' listing address addr
+        lo = bisect.bisect_left(self.ip_addrs, addr)
+        hi = bisect.bisect_right(self.ip_addrs, addr, lo)
+        i = bisect.bisect_left(self.ip_lines, after, lo, hi)
+        if i < hi:
+            return self.ip_lines[i]
+        return None
+
+    def hilite_line(self, typ, text, y, eol=None, quiet=False):
+        # highlight text on source line y and center on it, the way a
+        # search() that found it there would
+        sh,sw, fy,fx = self.focus_point()
+        ey,ex = self.extra_yx
+        parms = self.hilites[typ]
+        parms[Src.SP_TXT] = text
+        parms[Src.SP_LEN] = len(text)
+        x = -1
+        if y != None:
+            # searches skip leading whitespace but keep one leading space
+            x = (' ' + self.lines[y].strip()).find(text, 0, eol)
+        if x < 0:
+            parms[Src.SP_LNO] = None
+            if not quiet:
+                update_status(' [%s] not found' % text, CPhi)
+            self.rehilite(typ, parms)
+            return False
+        parms[Src.SP_LNO] = y       # update before center()
+        parms[Src.SP_STX] = x
+        self.rehilite(typ, parms)
+        self.center(ey+y - fy, x - fx)
+        return True
+
     def _init_hilites(self):
         # create the list of prioritized hilite locations
         rval = []
@@ -2062,22 +3517,27 @@ class Src(Background_panel):
         rval.append([None, None, 0, 0, CPip])
         return rval
 
-    def _unhilite(self):
-        ey,ex = self.extra_yx
-        for txt, lno, startx, xlen, cp in self.hilites:
-            if lno:
-                self.pad.chgat(ey+lno, startx, xlen, CPsrc)
-
     def rehilite(self, typ=None, newparms=None):
-        # first, do we have something to update?
+        # update a hilite, draw() shows them all
         if typ and newparms:
             self.hilites[typ] = newparms
+
+    def draw(self, sh, sw):
+        Background_panel.draw(self, sh, sw)
+        # apply the hilites that are on screen, in priority order
         ey,ex = self.extra_yx
         for txt, lno, startx, xlen, cp in self.hilites:
             #Log.write('++ txt(%s) lno(%s) stx(%d) l(%d)\n' % (
             #                       txt, str(lno), startx, xlen), CPdbg)
             if lno:
-                self.pad.chgat(ey+lno, startx, xlen, cp)
+                y = ey+lno - self.pady
+                x = startx - self.padx
+                if x < 0:
+                    xlen += x
+                    x = 0
+                xlen = min(xlen, sw - x)
+                if 0 <= y < sh-1  and  xlen > 0:
+                    self.pad.chgat(y, x, xlen, cp)
 
     def search(self, typ, text=None, eol=None, restart=True, quiet=False):
         # typ - is an index into self.hilites (the thing we are searching for)
@@ -2100,9 +3560,6 @@ class Src(Background_panel):
             update_status('no previous search term for this window', CPerr)
             return False
 
-        # reset previously highlighted text
-        self._unhilite()
-
         # where to start the search
         if parms[Src.SP_LNO]:
             # y,x are source line and position coordinates
@@ -2154,58 +3611,62 @@ class Src(Background_panel):
         # customized searches for ip values within each src file type
         # return True if a match for the ip was found
         hilitetyp = HILITETYP_IP if real_ip else HILITETYP_TXT
-
+        target = self.ip_target(ip)
+        if target == None:
+            return False
+        text, y, eol, quiet = target
+        return self.hilite_line(hilitetyp, text, y, eol, quiet)
+
+    def lists_ip(self, ip):
+        # True if this file has a line for ip
+        target = self.ip_target(ip)
+        return target != None and target[1] != None
+
+    def ip_target(self, ip):
+        # what ip_search() highlights for ip, (text, line, eol, quiet),
+        # the line None if it isn't listed.  None if the file can't
+        # hold ip at all.
         if self.ftype == 'nasmlst':         # 8 digits, uppercase hex
             if ip >= self.offset:
                 xx = ' %08X ' % (ip - self.offset)
                 #Log.write('++ ip=%08x  xx=%s\n' % (ip, xx), CPhi)
-                if self.search(hilitetyp, xx, 16):
-                    return True
+                return (xx, self.ip_line(ip - self.offset), 16, False)
         elif self.ftype == 'objdump':
             # find a code symbol, in the current source, below or at our ip
-            best = None
-            base = 0
-            label = None
-            for name, offset, segments, fixup in self.codesyms:
-                if offset <= ip:
-                #and len(set(segments).intersection(set(self.segments))) > 0:
-                    #Log.write('++ ip_search cand %s %s:%08x\n' % (name, str(segments), offset))
-                    if not best or offset >= best:
-                        best = offset
-                        base = fixup
-                        label = name
-            if best != None:
+            # (in any segment)
+            found = Symbols.below(ip, src=self)
+            if found:
+                (label, best, segments, base), src = found
                 #Log.write('++ best %08x %s\n' % (best, self.fname))
-                # We change tabs to spaces when the source file is loaded so
-                # the trailing space in the 'sstr' search below is dependable.
-                # But I'm not sure about the leading space, suppose a single
-                # C function is longer than 4k bytes of code?  0x1000
-                # is the space still there?
-                #
                 # base is used here instead of best because of the way objdump
                 # displays instruction addresses within functions - addreses
                 # are displayed relative to the segment base address instead of
                 # the the function address.
                 sstr = ' %x: ' % (ip - base)
                 #Log.write('ip_search: [%s] -> [%s]\n' % (label, sstr))  # DEBUG
-                # lookup label first, but confine the search to the left
-                # margin (ought to replace this with something like:
-                #         re.search('[0-9a-f]* <([\w_]*)>:', ln) ... the same
-                #         way read_nextip_at_or_after_focus_point() works)
-                # 20 is a guess as to how much fluff surrounds the label
-                if self.search(hilitetyp, label, len(label)+20) == None:
-                    return False
-                # finally, find the offset in the left margin
-                if self.search(hilitetyp, sstr, len(sstr)+4, restart=False, quiet=True):
-                    return True
-        return False
+                if not label in self.labels:
+                    # reported as ' [label] not found'
+                    return (label, None, None, False)
+                # the first line listing the offset below the label, else
+                # the first one above it
+                y = self.ip_line(ip - base, self.labels[label])
+                if y == None:
+                    y = self.ip_line(ip - base)
+                return (sstr, y, len(sstr)+4, True)
+            else:
+                # static functions don't make it into map files, so
+                # fall back to the map section that holds our ip
+                for start, end in self.ranges:
+                    if start <= ip < end:
+                        sstr = ' %x: ' % (ip - start)
+                        return (sstr, self.ip_line(ip - start), len(sstr)+4, True)
+        return None
 
     def read_nextip_at_or_after_focus_point(self):
         global Nextip
         sh,sw, fy,fx = self.focus_point()
         ey,ex = self.extra_yx
 
-        self._unhilite()
         parms = None
 
         # find where the ip is highlighted
@@ -2220,63 +3681,33 @@ class Src(Background_panel):
         ip = None
         ipl = 0
         xs = xl = 0
+        # the first code line on or below the focus point, from the index
+        # built by index_lines()
+        i = bisect.bisect_left(self.nip_lines, start_line)
+        if i < len(self.nip_lines) and cipy and self.nip_lines[i] == cipy:
+            i += 1                  # avoid the current ip location
         if self.ftype == 'nasmlst':
-            for l in range(start_line, len(self.lines)):
-                if cipy and l == cipy:      # avoid the current ip location
-                    continue
-                # only look at lines that generate addresses
-                if len(self.lines[l]) < 40:
-                    continue
-                ip = self.lines[l][7:15]
-                if ishexdigit(ip) == False:
-                    ip = None
-                    continue
-                # check first 3 assembler keywords for non-opcodes
-                keywords = self.lines[l][40:].split()[:3]
-                if len(keywords) == 0 \
-                or len(set(keywords).intersection(set(Non_opcode_keywords))) > 0:
-                    ip = None
-                    continue
+            if i < len(self.nip_lines):
                 # found the next valid ip
+                ip = self.nip_addrs[i]
                 Nextip = '%x' % (self.offset + int(ip , 16))
-                ipl = l
+                ipl = self.nip_lines[i]
                 xs = 7
                 xl = 8
-                break
 
         elif self.ftype == 'objdump':
-            # rewind to find the most recent .text label
-            lbln = lbll = None
-            for l in range(start_line, 0, -1):
-                mobj = re.search('[0-9a-f]* <([\w_]*)>:', self.lines[l])
-                if mobj:
-                    #Log.write('++ mobj: %s\n' % str(mobj.group(1)), CPdbg)
-                    lbln = mobj.group(1)
-                    lbll = l
-                    break
-
-            # or the proper label may be ahead of us ...
-            # while there are no code lines, keep looking for a label
             ip = None
             ipl = 0
-            for l in range(start_line, len(self.lines)):
-                if cipy and l == cipy:      # avoid the current ip location
-                    continue
-                ln = self.lines[l]
-                if len(ln) < 5:
-                    continue
-                # precarious! depending on objdump to always print offsets
-                # with a colon in the 4th column :O
-                if self.lines[l][4] == ':' and hexchk(self.lines[l][0:4]):
-                    ip = self.lines[l][0:4].strip()
-                    ipl = l
-                    xs = 0
-                    xl = 4
-                    break
-                mobj = re.search('[0-9a-f]* <([\w_]*)>:', self.lines[l])
-                if mobj:
-                    lbln = mobj.group(1)
-                    lbll = l
+            lbln = None
+            if i < len(self.nip_lines):
+                ip = self.nip_addrs[i]
+                ipl = self.nip_lines[i]
+                xs = 0
+                xl = 4
+                # the most recent .text label above that line
+                j = bisect.bisect_left(self.label_lines, ipl)
+                if j > 0:
+                    lbln = self.label_names[j-1]
 
             # ipl now should point to the first line of code below the focus
             # point and lbll,lbln document the .text label for that line of
@@ -2446,6 +3877,8 @@ def load_gccmap_file(fname, segs, file_base):
                     # we don't know the ftype, let Src() figure it out
                     srcobj = Src(lstfname, None, segs, file_base + file_offset)
                     parsed_something = True
+                srcobj.ranges.append((file_base + sec_base,
+                                      file_base + sec_base + int(t3, 16)))
                 state = 'code'
             elif not ln.startswith('   '):
                 # skip other .<section>
@@ -2601,6 +4034,12 @@ def inputmode_normal(c):
         Gdbc.cont_all()
     elif ch and ch in 'hH':
         Helps[0].toggle()
+    elif ch and ch in 'i':
+        Gdbc.interrupt()
+    elif ch and ch in 't':
+        Stats.toggle()
+    elif ch and ch in 'T':
+        dump_stats()
     elif ch and ch in 'jJ':
         if Nextip:
             credit_current_src()
@@ -2631,6 +4070,7 @@ def inputmode_normal(c):
     #    dump_target_mem()
     elif ch and ch in 'rR':
         reorder_cpu_panels(Gdbc.stopped_thread, Gdbc.nthreads)
+        Gdbc.relist_threads()
         refresh_all()
     elif ch and ch in 's':
         credit_current_src()
@@ -2678,7 +4118,7 @@ def hexval(v):
 def simple_eval(ex, vals):
     # parse a simple aritmetic expression with named variables
     # vals should be a dict of names (data symbols, register names, etc.)
-    lst1 = re.split('(\+|-|\*)', ex)
+    lst1 = re.split(r'(\+|-|\*)', ex)
     # rebuild lst validating tokens and replacing with values
     lst2 = []
     for tok in lst1:
@@ -2938,16 +4378,25 @@ def inputmode_memwrite(c):
     return inputmode_memwrite
 
 def dump_target_mem():
-    # doesn't display anything, only useful if the Log.write('r--' ...)
-    # in handle_read is enabled ...
+    # doesn't display anything but process_mem's status line, the data
+    # is only in the future queue_cmd() returns ...
     Gdbc.queue_cmd('m7000,32')
     return
 
 # ----------------------------------------------------------------------------
 # main
 
+def log_loop_exception(loop, context):
+    # python exceptions raised in event loop callbacks go to the log window
+    exc = context.get('exception')
+    if exc:
+        st = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+    else:
+        st = context.get('message', '') + '\n'
+    Log.write('event loop exception: %s' % st, CPerr)
+
 def main(stdscr):
-    global Stdscr, Log, Helps, Gdbc, Fail
+    global Stdscr, Log, Helps, Gdbc, Fail, Session, Stats
     Stdscr = stdscr
 
     init_colors()
@@ -2960,6 +4409,7 @@ def main(stdscr):
         return
     Log.write(Version + '\n')
 
+    Stats = Statistics()
     Helps.append(Help(Help_text_main))
     Helps.append(Help(Help_text_breakpoints))
     Helps.append(Help(Help_text_mem_address))
@@ -2967,7 +4417,17 @@ def main(stdscr):
     Helps[1].toggle()
     Helps[2].toggle()
 
+    # keyboard input and the rdp connection are both readers on
+    # a single event loop, so whichever one has data runs first.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.set_exception_handler(log_loop_exception)
+
     Gdbc = GdbClient()
+    if Record_file:
+        Session = SessionRecorder(Record_file)
+    if not Replay_file:
+        loop.create_task(Gdbc.connect())
 
     # load src files
     srctype = "nasmlst"             # default to nasm lst files
@@ -2983,26 +4443,67 @@ def main(stdscr):
         dump_symbols(src)
 
     stdscr.nodelay(1)               # make getch() non-blocking
-    stdscr.timeout(100)             # (ms) reduce cpu usage while still
-                                    # responding immediately to key strokes
     inputmode = inputmode_normal
-    n = 0
-    while (inputmode):
-        c = stdscr.getch()          # ESC delay is internal (waiting for FN keys)
-        if c > -1:
+
+    def read_keys():
+        nonlocal inputmode
+        nkeys = 0
+        while inputmode:
+            c = stdscr.getch()      # ESC delay is internal (waiting for FN keys)
+            if c < 0:
+                break
+            nkeys += 1
+            if Session:
+                Session.record(b'k', b'%d' % c)
             inputmode = inputmode(c)
+        if nkeys:
+            refresh_all()
+        if not inputmode:
+            loop.stop()
+
+    def poll_keys():
+        # a terminal resize doesn't make stdin readable, curses only
+        # reports it (as KEY_RESIZE) from getch(), so look now and then
+        if not inputmode:
+            return                  # quitting
+        read_keys()
+        loop.call_later(Key_poll_interval, poll_keys)
+
+    def replay_key(c):
+        # a recorded quit key doesn't end the replay, a real one does
+        nonlocal inputmode
+        inputmode = inputmode(c) or inputmode
         refresh_all()
-        asyncore.loop(timeout=0.01, count=4)
-        #update_status('++ n = %d' % n, CPdbg)
-        n += 1
+
+    if Replay_file:
+        try:
+            Gdbc.connection_made(ReplayTransport(Gdbc, Replay_file, replay_key))
+        except:
+            Log.write('cannot replay %s: %s\n' % (Replay_file, sys.exc_info()[1]), CPerr)
+
+    loop.add_reader(sys.stdin.fileno(), read_keys)
+    loop.call_later(Key_poll_interval, poll_keys)
+    refresh_all()
+    loop.run_forever()
+    loop.remove_reader(sys.stdin.fileno())
+    # give a final command (eg. 'k') a moment to go out
+    loop.run_until_complete(asyncio.sleep(0.05))
+    if Gdbc.transport:
+        Gdbc.transport.close()
+    if Session:
+        Session.close()
+    loop.close()
+    for src in Srcs:
+        src.close()
     stdscr.nodelay(0)               # restore blocking
 
     h,w = stdscr.getmaxyx()         # attempt to position cursor
     stdscr.move(h-1, 0)             # correctly in previous terminal screen
 
 
-curses.wrapper(main)
+if __name__ == '__main__':
+    curses.wrapper(main)
 
-if Fail:
-    print(Fail)
+    if Fail:
+        print(Fail)
 
@@ -91,11 +91,9 @@ def cpu_reg_update(self, newregs, mode):
     #        rdata += ' %5s' % spec[0] + ' %s' % val + eol
     #    i += 1
 
-    # lol, messy, but cool
+    # ds_print_one wants the flags as target memory bytes
     x = newregs['cpsr']
-    fla = '%02x' % (x&0xff) + '%02x' % ((x&0xff00)>>8)
-    fla += '%02x' % ((x&0xff0000)>>16)
-    fla += '%02x' % ((x&0xff000000)>>24)
+    fla = (x & 0xffffffff).to_bytes(4, 'little')
     flstr = DSfns['ds_print_one'](fla, ds_cpsr)[0]
     strs.append((5, 14, '%44s' % flstr))
 
@@ -231,18 +231,17 @@ def cpu_reg_update(self, newregs, mode):
         strs.append((1, 2, 'unknown register set (%d)' % mode))
 
 
-    # lol, messy, but cool
+    # ds_print_one wants the flags as target memory bytes
     x = newregs['eflags']
-    fla = '%02x' % (x&0xff) + '%02x' % ((x&0xff00)>>8) + '%02x00' % ((x&0xff0000)>>16)
+    fla = (x & 0xffffff).to_bytes(4, 'little')
     flstr = DSfns['ds_print_one'](fla, ds_eflags)[0]
     if mode == 616 or mode == 552:
         # so the max possible eflags string is like 53,
         # here I hope that not all flags will be on at the same time
         strs.append((5, 14, '%45s' % flstr))
     elif mode == 1072:
-        ## lol, messy, but cool
         #x = newregs['eflags']
-        #fla = '%02x' % (x&0xff) + '%02x' % ((x&0xff00)>>8) + '%02x00' % ((x&0xff0000)>>16)
+        #fla = (x & 0xffffff).to_bytes(4, 'little')
         #flstr = DSfns['ds_print_one'](fla, ds_rflags)[0]
         strs.append((9, 16, '%45s' % flstr))
 
@@ -583,15 +582,16 @@ ds_rflags = DS('flags64', '64 bit cpu flags', 4, 1, 45, None, _rflags_els)
 # if __name__ == "__main__":
 #     # example: multiple gdt entries
 #     loop_offset = 0     # in bytes
-#     while loop_offset*2 < len(sample_gdt):
+#     gdt = bytes.fromhex(sample_gdt)
+#     while loop_offset < len(gdt):
 #         # break data into descriptor size chunks
-#         data = sample_gdt[loop_offset*2:(loop_offset+ds_gdt.dlen)*2]
+#         data = gdt[loop_offset:loop_offset+ds_gdt.dlen]
 #         for ln in ds_print_one(data, ds_gdt):
 #             print(ln)
 #         loop_offset += ds_gdt.dlen
 # 
 #     # example: one tss
-#     for ln in ds_print_one(sample_tss, ds_tss):
+#     for ln in ds_print_one(bytes.fromhex(sample_tss), ds_tss):
 #         print(ln)
 
 data_structs = [ds_gdt, ds_gdt64, ds_tss, ds_eflags, ds_rflags]
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# vi: set tabstop=8 expandtab softtabstop=4 shiftwidth=4
+#
+# PGDB mock gdbstub
+#
+# a stand-in for qemu's gdbstub, so pgdb can be exercised (and measured)
+# without an emulator.  only the subset of the gdb remote debug protocol
+# (rdp) that pgdb actually uses is implemented:
+#
+#   qSupported, QStartNoAckMode, qXfer:features:read, qXfer:threads:read,
+#   ?, qfThreadInfo, qsThreadInfo, Hg, g, p, m, M, Z0/Z2/z0/z2,
+#   vCont (s and c), s, c, k
+#   and the out-of-band 0x03 interrupt.
+#
+# there is no cpu emulation: a step advances the pc by one instruction
+# size and a continue runs until the next -script stop event (or an
+# interrupt).  breakpoints are accepted but never hit.
+#
+# usage:
+#   $ python pgdb_stub.py [-remote tcp::1234] [-arch i386] [-smp 8]
+#                         [-mem image.bin@7c00] [-pc 7c00] [-latency 1]
+#                         [-script stops.txt] [-expedite] [-packetsize 1000]
+#   (then from a separate terminal)
+#   $ python pgdb.py -remote tcp::1234 -nasmlst image.lst
+#
+#   -remote    tcp::port or unix:path to listen on (default tcp::1234),
+#              stdio to talk to pgdb -remote stdio:..., or pty to open a
+#              pty and print its name for pgdb -remote pty:/dev/pts/N
+#   -arch      i386, aarch64 or arm target description (default i386)
+#   -smp       number of cpus / threads (default 1)
+#   -mem       load a binary file into target memory at a hex address,
+#              may be repeated.
+#   -ram       hex size of zero filled memory at address 0 (default 100000).
+#              memory that is neither -ram nor -mem reads as 'E14' (page
+#              fault), the same way qemu reports it; use -ram 0 to have
+#              only the -mem files readable.
+#   -pc        hex start address for every cpu's instruction pointer
+#   -latency   milliseconds to wait before every reply packet
+#   -script    a file of stop events consumed one per continue, one per
+#              line:  cpu=<n> pc=<hex> [after=<seconds>] [signal=<hex>]
+#              with no events left, a continued target runs until pgdb
+#              sends the 0x03 interrupt.
+#   -expedite  include the pc in T stop replies (qemu doesn't, gdbserver does)
+#   -packetsize hex PacketSize reported by qSupported (default 1000),
+#              m replies are cut short to fit in it
+#   -v         log every packet to stderr
+
+import os
+import tty
+import sys
+import time
+import asyncio
+import binascii
+
+
+# ----------------------------------------------------------------------------
+# target descriptions
+#
+# the register sets are sized so that the 'g' reply lengths match the
+# spec tables in the pgdb_<arch>.py modules.
+
+def _regs_i386():
+    # sized to match pgdb_i386.gspec64 (1072 hex digits)
+    regs = [(n, 64) for n in ['rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi',
+                              'rbp', 'rsp', 'r8', 'r9', 'r10', 'r11',
+                              'r12', 'r13', 'r14', 'r15', 'rip']]
+    regs += [('eflags', 32)]
+    regs += [(n, 32) for n in ['cs', 'ss', 'ds', 'es', 'fs', 'gs']]
+    regs += [(n, 64) for n in ['fs_base', 'gs_base', 'k_gs_base', 'cr3']]
+    regs += [('st%d' % i, 40) for i in range(16)]
+    regs += [('xmm%d' % i, 128) for i in range(16)]
+    regs += [('mxcsr', 32)]
+    return regs
+
+def _regs_aarch64():
+    regs = [('x%d' % i, 64) for i in range(31)]
+    regs += [('sp', 64), ('pc', 64), ('cpsr', 32)]
+    return regs
+
+def _regs_arm():
+    regs = [('r%d' % i, 32) for i in range(13)]
+    regs += [('sp', 32), ('lr', 32), ('pc', 32), ('cpsr', 32)]
+    return regs
+
+Packet_size = 0x1000        # what qSupported reports, -packetsize
+
+Targets = {
+    'i386':    {'arch': 'i386:x86-64', 'feature': 'org.gnu.gdb.i386.64bit',
+                'xml': 'i386-64bit.xml', 'regs': _regs_i386(),
+                'pc': 'rip', 'step': 1, 'flags': ('eflags', 0x2)},
+    'aarch64': {'arch': 'aarch64', 'feature': 'org.gnu.gdb.aarch64.core',
+                'xml': 'aarch64-core.xml', 'regs': _regs_aarch64(),
+                'pc': 'pc', 'step': 4, 'flags': ('cpsr', 0x3c5)},
+    'arm':     {'arch': 'arm', 'feature': 'org.gnu.gdb.arm.core',
+                'xml': 'arm-core.xml', 'regs': _regs_arm(),
+                'pc': 'pc', 'step': 4, 'flags': ('cpsr', 0x1d3)},
+}
+
+def threads_xml(ncpus):
+    doc = '<?xml version="1.0"?>\n<threads>\n'
+    for i in range(ncpus):
+        doc += '<thread id="%x" core="%d" name="CPU#%d"/>\n' % (i+1, i, i)
+    return doc + '</threads>\n'
+
+def xfer_chunk(doc, off, length):
+    # one qXfer read reply, 'm' if there is more to come.  the data is
+    # binary, so $ # } and * are escaped as '}' and the char xor 0x20
+    chunk = ''.join(['}' + chr(ord(c) ^ 0x20) if c in '$#}*' else c
+                     for c in doc[off:off+length]])
+    return ('l' if off + length >= len(doc) else 'm') + chunk
+
+def target_xml(tgt):
+    return ('<?xml version="1.0"?><!DOCTYPE target SYSTEM "gdb-target.dtd">'
+            '<target><architecture>%s</architecture>'
+            '<xi:include href="%s"/></target>' % (tgt['arch'], tgt['xml']))
+
+def feature_xml(tgt):
+    rval = '<?xml version="1.0"?><!DOCTYPE feature SYSTEM "gdb-target.dtd">'
+    rval += '<feature name="%s">' % tgt['feature']
+    for n, bits in tgt['regs']:
+        rval += '<reg name="%s" bitsize="%d" type="int%d"/>' % (n, bits, bits)
+    return rval + '</feature>'
+
+
+# ----------------------------------------------------------------------------
+# target state
+
+class Target(object):
+    def __init__(self, arch, ncpus, pc):
+        self.tgt = Targets[arch]
+        self.regs = [dict((n, 0) for n, bits in self.tgt['regs'])
+                                                    for i in range(ncpus)]
+        for regs in self.regs:
+            regs[self.tgt['pc']] = pc
+            regs[self.tgt['flags'][0]] = self.tgt['flags'][1]
+        self.mem = []               # [(base, bytearray)]
+        self.stops = []             # [(cpu, pc, after, signal)]
+        self.breakpoints = set()
+        self.stopped = 0            # cpu index of the last stop
+
+    def load(self, base, data):
+        self.mem.insert(0, (base, bytearray(data)))
+
+    def _region(self, addr, length):
+        for base, data in self.mem:
+            if base <= addr and addr + length <= base + len(data):
+                return base, data
+        return None, None
+
+    def read(self, addr, length):
+        base, data = self._region(addr, length)
+        if data == None:
+            return None
+        return bytes(data[addr-base:addr-base+length])
+
+    def write(self, addr, byts):
+        base, data = self._region(addr, len(byts))
+        if data == None:
+            return False
+        data[addr-base:addr-base+len(byts)] = byts
+        return True
+
+    def get_reg(self, cpu, regnum):
+        n, bits = self.tgt['regs'][regnum]
+        v = self.regs[cpu][n] & ((1 << bits) - 1)
+        return binascii.hexlify(v.to_bytes(bits//8, 'little')).decode() \
+                    if bits % 8 == 0 else '%0*x' % (bits//4, v)
+
+    def get_regs(self, cpu):
+        return ''.join([self.get_reg(cpu, i) for i in range(len(self.tgt['regs']))])
+
+    def step(self, cpu):
+        self.regs[cpu][self.tgt['pc']] += self.tgt['step']
+
+
+# ----------------------------------------------------------------------------
+# rdp server
+
+def chksum(s):
+    return '%02x' % (sum(s.encode('latin-1')) & 0xff)
+
+class StubServer(asyncio.Protocol):
+    def __init__(self, target, latency, expedite, verbose):
+        self.verbose = verbose
+        self.target = target
+        self.latency = latency
+        self.expedite = expedite
+        self.transport = None
+        self.ack = True
+        self.rbuf = b''
+        self.packets = asyncio.Queue()
+        self.interrupt = asyncio.Event()
+        self.thread = 1             # Hg selection, 1 based
+        self.next_thread = None     # qfThreadInfo/qsThreadInfo cursor
+        self.task = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.task = asyncio.get_event_loop().create_task(self.serve())
+        log('connection from %s' % str(transport.get_extra_info('peername')))
+
+    def connection_lost(self, exc):
+        if self.task:
+            self.task.cancel()
+        log('connection closed')
+
+    def data_received(self, data):
+        self.rbuf += data
+        while self.rbuf:
+            c = self.rbuf[:1]
+            if c in (b'+', b'-'):
+                self.rbuf = self.rbuf[1:]
+            elif c == b'\x03':
+                self.rbuf = self.rbuf[1:]
+                self.interrupt.set()
+            elif c == b'$':
+                h = self.rbuf.find(b'#')
+                if h < 0 or len(self.rbuf) < h + 3:
+                    return
+                pkt = self.rbuf[1:h].decode('latin-1')
+                self.rbuf = self.rbuf[h+3:]
+                if self.ack:
+                    self.transport.write(b'+')
+                if self.verbose:
+                    log('<- %s' % pkt[:60])
+                self.packets.put_nowait((pkt, time.time()))
+            else:
+                self.rbuf = self.rbuf[1:]
+
+    def reply(self, s):
+        if self.verbose:
+            log('-> %s' % s[:60])
+        self.transport.write(('$%s#%s' % (s, chksum(s))).encode('latin-1'))
+
+    async def serve(self):
+        while True:
+            # latency is modelled as a wire delay: each reply goes out no
+            # sooner than 'latency' after its packet arrived, in order.
+            pkt, arrived = await self.packets.get()
+            rval = await self.handle(pkt)
+            if rval == None:
+                continue
+            delay = arrived + self.latency - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.reply(rval)
+            if pkt == 'QStartNoAckMode':
+                self.ack = False
+
+    def stop_reply(self, cpu, signal=5):
+        self.target.stopped = cpu
+        rval = 'T%02xthread:%02x;' % (signal, cpu+1)
+        if self.expedite:
+            tgt = self.target.tgt
+            for i, (n, bits) in enumerate(tgt['regs']):
+                if n == tgt['pc']:
+                    v = self.target.regs[cpu][n]
+                    rval += '%x:%s;' % (i, binascii.hexlify(
+                                    v.to_bytes(bits//8, 'little')).decode())
+        return rval
+
+    async def run(self, cpus):
+        # resume until the next scripted stop, or until interrupted
+        self.interrupt.clear()
+        if self.target.stops:
+            cpu, pc, after, signal = self.target.stops.pop(0)
+            try:
+                await asyncio.wait_for(self.interrupt.wait(), after)
+            except asyncio.TimeoutError:
+                self.target.regs[cpu][self.target.tgt['pc']] = pc
+                return self.stop_reply(cpu, signal)
+        else:
+            await self.interrupt.wait()
+        return self.stop_reply(cpus[0] if cpus else self.target.stopped, 2)
+
+    async def handle(self, pkt):
+        tgt = self.target
+        if pkt.startswith('qSupported'):
+            return 'PacketSize=%x;qXfer:features:read+;qXfer:threads:read+;' \
+                   'QStartNoAckMode+' % Packet_size
+        elif pkt == 'QStartNoAckMode':
+            return 'OK'
+        elif pkt.startswith('qXfer:features:read:'):
+            annex, rng = pkt.split(':')[3:5]
+            off, length = [int(x, 16) for x in rng.split(',')]
+            if annex == 'target.xml':
+                doc = target_xml(tgt.tgt)
+            elif annex == tgt.tgt['xml']:
+                doc = feature_xml(tgt.tgt)
+            else:
+                return 'E00'
+            return xfer_chunk(doc, off, length)
+        elif pkt.startswith('qXfer:threads:read::'):
+            off, length = [int(x, 16) for x in pkt.split(':')[4].split(',')]
+            return xfer_chunk(threads_xml(len(tgt.regs)), off, length)
+        elif pkt == '?':
+            return self.stop_reply(tgt.stopped)
+        elif pkt == 'qfThreadInfo':
+            self.next_thread = 1
+            return 'm01'
+        elif pkt == 'qsThreadInfo':
+            if self.next_thread == None or self.next_thread >= len(tgt.regs):
+                return 'l'              # no enumeration in progress, or done
+            self.next_thread += 1
+            return 'm%02x' % self.next_thread
+        elif pkt == 'qC':
+            return 'QC%02x' % (tgt.stopped+1)
+        elif pkt.startswith('Hg'):
+            th = int(pkt[2:], 16)
+            if th > 0:
+                self.thread = th
+            return 'OK'
+        elif pkt == 'g':
+            return tgt.get_regs(self.thread-1)
+        elif pkt.startswith('p'):
+            regnum = int(pkt[1:], 16)
+            if regnum >= len(tgt.tgt['regs']):
+                return 'E00'
+            return tgt.get_reg(self.thread-1, regnum)
+        elif pkt.startswith('m'):
+            addr, length = [int(x, 16) for x in pkt[1:].split(',')]
+            # like gdbserver, answer at most what fits in a packet
+            length = min(length, (Packet_size - 4) // 2)
+            data = tgt.read(addr, length)
+            return 'E14' if data == None else binascii.hexlify(data).decode()
+        elif pkt.startswith('M'):
+            where, byts = pkt[1:].split(':')
+            addr = int(where.split(',')[0], 16)
+            ok = tgt.write(addr, binascii.unhexlify(byts))
+            return 'OK' if ok else 'E14'
+        elif pkt[:2] in ['Z0', 'Z2', 'z0', 'z2']:
+            addr = int(pkt.split(',')[1], 16)
+            if pkt[0] == 'Z':
+                tgt.breakpoints.add(addr)
+            else:
+                tgt.breakpoints.discard(addr)
+            return 'OK'
+        elif pkt == 'vCont?':
+            return 'vCont;c;C;s;S'
+        elif pkt.startswith('vCont;'):
+            steps = []
+            conts = []
+            for action in pkt.split(';')[1:]:
+                parts = action.split(':')
+                th = int(parts[1], 16) - 1 if len(parts) > 1 else tgt.stopped
+                if parts[0] == 's':
+                    steps.append(th)
+                else:
+                    conts.append(th)
+            if steps:
+                for cpu in steps:
+                    tgt.step(cpu)
+                return self.stop_reply(steps[0])
+            return await self.run(conts)
+        elif pkt == 's':
+            tgt.step(self.thread-1)
+            return self.stop_reply(self.thread-1)
+        elif pkt == 'c':
+            return await self.run([])
+        elif pkt == 'k':
+            log('killed')
+            self.transport.close()
+            asyncio.get_event_loop().stop()
+            return None
+        elif pkt == 'D':
+            return 'OK'
+        return ''       # unsupported
+
+
+# ----------------------------------------------------------------------------
+# main
+
+class PipeWriter(object):
+    # the write half of stdio or a pty, as much of a transport as
+    # StubServer needs
+    def __init__(self, wtransport):
+        self.wtransport = wtransport
+
+    def write(self, data):
+        self.wtransport.write(data)
+
+    def get_extra_info(self, name):
+        return None
+
+class PipeServer(asyncio.Protocol):
+    # the read half of stdio or a pty, feeds one StubServer
+    def __init__(self, stub, wtransport):
+        self.stub = stub
+        self.wtransport = wtransport
+
+    def connection_made(self, transport):
+        self.stub.connection_made(PipeWriter(self.wtransport))
+
+    def data_received(self, data):
+        self.stub.data_received(data)
+
+    def connection_lost(self, exc):
+        self.stub.connection_lost(exc)
+        asyncio.get_event_loop().stop()
+
+def serve_pipes(loop, stub, rfile, wfile):
+    wtransport, _ = loop.run_until_complete(
+                        loop.connect_write_pipe(asyncio.Protocol, wfile))
+    loop.run_until_complete(
+                        loop.connect_read_pipe(lambda: PipeServer(stub, wtransport), rfile))
+
+def log(s):
+    sys.stderr.write('pgdb_stub: %.3f %s\n' % (time.time() % 1000, s))
+
+def load_script(fname, target):
+    with open(fname) as fh:
+        for ln in fh.readlines():
+            ln = ln.split('#')[0].strip()
+            if len(ln) == 0:
+                continue
+            ev = dict(kv.split('=', 1) for kv in ln.split())
+            target.stops.append((int(ev.get('cpu', '0')),
+                                 int(ev['pc'], 16),
+                                 float(ev.get('after', '0')),
+                                 int(ev.get('signal', '5'), 16)))
+
+def main(argv):
+    remote = 'tcp::1234'
+    arch = 'i386'
+    ncpus = 1
+    pc = 0
+    ram = 0x100000
+    latency = 0
+    expedite = False
+    verbose = False
+    mems = []
+    script = None
+    args = list(argv)
+    try:
+        while args:
+            a = args.pop(0)
+            if   a == '-remote':    remote = args.pop(0)
+            elif a == '-arch':      arch = args.pop(0)
+            elif a == '-smp':       ncpus = int(args.pop(0))
+            elif a == '-pc':        pc = int(args.pop(0), 16)
+            elif a == '-ram':       ram = int(args.pop(0), 16)
+            elif a == '-latency':   latency = float(args.pop(0)) / 1000
+            elif a == '-script':    script = args.pop(0)
+            elif a == '-expedite':  expedite = True
+            elif a == '-v':         verbose = True
+            elif a == '-packetsize':
+                global Packet_size
+                Packet_size = int(args.pop(0), 16)
+            elif a == '-mem':
+                fname, addr = args.pop(0).rsplit('@', 1)
+                mems.append((fname, int(addr, 16)))
+            else:
+                raise Exception('unknown argument ' + a)
+        if arch not in Targets:
+            raise Exception('unknown arch %s, pick one of %s' % (
+                                        arch, ' '.join(sorted(Targets))))
+    except:
+        print('usage: python pgdb_stub.py [-remote tcp::1234|unix:path|stdio|pty] [-arch i386]')
+        print('        [-smp 1] [-mem file@addr] [-ram 100000] [-pc addr]')
+        print('        [-latency ms] [-script stops] [-expedite] [-packetsize 1000] [-v]')
+        print(sys.exc_info()[1])
+        return 1
+
+    target = Target(arch, ncpus, pc)
+    if ram:
+        target.load(0, bytes(ram))
+    for fname, addr in mems:
+        with open(fname, 'rb') as fh:
+            target.load(addr, fh.read())
+    if script:
+        load_script(script, target)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    factory = lambda: StubServer(target, latency, expedite, verbose)
+    server = None
+    if remote == 'stdio':
+        # pgdb -remote 'stdio:python pgdb_stub.py -remote stdio'
+        serve_pipes(loop, factory(), os.fdopen(os.dup(0), 'rb', 0),
+                                     os.fdopen(os.dup(1), 'wb', 0))
+    elif remote == 'pty':
+        # like qemu -gdb pty, announce the slave for pgdb -remote pty:path
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        log('char device redirected to %s' % os.ttyname(slave))
+        serve_pipes(loop, factory(), os.fdopen(master, 'rb', 0),
+                                     os.fdopen(os.dup(master), 'wb', 0))
+    elif remote.startswith('unix:'):
+        path = remote[5:]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = loop.run_until_complete(loop.create_unix_server(factory, path))
+    else:
+        medium, host, port = remote.split(':')
+        server = loop.run_until_complete(
+                    loop.create_server(factory, host or '0.0.0.0', int(port)))
+    log('%s target with %d cpu(s) listening on %s' % (arch, ncpus, remote))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    if server:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
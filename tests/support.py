@@ -0,0 +1,107 @@
+#
+# shared setup for the pgdb tests
+#
+# pgdb.py is a curses program, so the tests import it as a module (it
+# only starts curses when run as a script) and stand in for the panels
+# the code under test writes to: the Log window, the status line and
+# the rdp stats panel.
+#
+# run them with either of
+#   $ python -m pytest -q
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import asyncio
+import unittest
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not Root in sys.path:
+    sys.path.insert(0, Root)
+
+# pgdb reads its options at import, don't let it see the test runner's
+argv = sys.argv
+sys.argv = ['pgdb.py']
+try:
+    import pgdb
+finally:
+    sys.argv = argv
+
+# the color pairs init_colors() would set up
+for name in ['CPnrm', 'CPerr', 'CPok', 'CPinfo', 'CPdbg', 'CPhi', 'CPbdr',
+             'CPtitle1', 'CPtitle0', 'CPchg', 'CPsrc', 'CPip', 'CPnip',
+             'CPbp', 'CPtxt']:
+    setattr(pgdb, name, 0)
+
+
+class Recorder(object):
+    # the Log window and the status line, as lists of what was written
+    def __init__(self):
+        self.lines = []
+        self.status = []
+
+    def write(self, s, attr=None):
+        self.lines.append(s)
+
+    def text(self):
+        return ''.join(self.lines)
+
+class FakeStats(object):
+    # a hidden rdp stats panel
+    visible = False
+
+    def update_soon(self):
+        pass
+
+class Transport(object):
+    # collects what the GdbClient sends
+    def __init__(self):
+        self.sent = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.sent += data
+
+    def close(self):
+        self.closed = True
+
+def use_arch(name):
+    # load pgdb_<name>.py the way pgdb does when the target reports it
+    pgdb.Arch = None
+    pgdb.Arch_name = name
+    pgdb.load_arch_module()
+    return pgdb.Arch
+
+def packet(s):
+    # s framed as an rdp packet
+    return ('$%s#%02x' % (s, sum(s.encode('latin-1')) & 0xff)).encode('latin-1')
+
+
+class PgdbTestCase(unittest.TestCase):
+    # each test gets its own event loop (GdbClient futures need one)
+    # and fresh stand-ins for the panels, in self.log
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.log = Recorder()
+        pgdb.Log = self.log
+        pgdb.Stats = FakeStats()
+        pgdb.Session = None
+        pgdb.Srcs[:] = []
+        pgdb.Cpus.clear()
+        self.saved = (pgdb.update_status, pgdb.refresh_all)
+        pgdb.update_status = lambda s=None, attr=None: self.log.status.append(s)
+        pgdb.refresh_all = lambda: None
+
+    def tearDown(self):
+        pgdb.update_status, pgdb.refresh_all = self.saved
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def client(self):
+        # a GdbClient connected to a Transport, without the qSupported
+        # the startup sequence begins with
+        gdbc = pgdb.GdbClient()
+        gdbc.cmds = []
+        gdbc.connection_made(Transport())
+        return gdbc
@@ -0,0 +1,87 @@
+#
+# the compiled FADS decoders print exactly what the field by field
+# interpretation of the same specs does
+
+import random
+import unittest
+
+from support import pgdb
+import pgdb_i386
+import pgdb_arm
+import pgdb_aarch64
+
+Specs = pgdb_i386.data_structs + pgdb_arm.data_structs + pgdb_aarch64.data_structs
+
+
+def slow_print_one(data, ds_spec):
+    # every field reconstructed and matched as the spec is walked
+    strs = []
+    lno = 0
+    ln = ''
+    vals = ''
+    for el in ds_spec.elements:
+        while lno != el.y:
+            strs.append((ln + vals)[:ds_spec.width])
+            ln = ''
+            vals = ''
+            lno += 1
+        ln += ' ' * (el.x - len(ln))
+        rln, val = pgdb.ds_reconstruct(data, el.build)
+        if not el.name.startswith('_'):
+            ln += el.name + rln
+        vals += pgdb.ds_match_field_values(val, el.vals)
+    strs.append((ln + vals)[:ds_spec.width])
+    return strs
+
+def slow_print(data, ds_spec, start_addr):
+    strs = []
+    for off in range(0, len(data), ds_spec.dlen):
+        if ds_spec.height > 1 and ds_spec.header:
+            strs.append(ds_spec.header % (start_addr + off))
+        for ln in slow_print_one(data[off:off+ds_spec.dlen], ds_spec):
+            if ds_spec.height == 1 and ds_spec.header:
+                ln = ds_spec.header % (start_addr + off) + ln
+            strs.append(ln)
+    return strs
+
+
+class FadsTest(unittest.TestCase):
+
+    def records(self, ds_spec):
+        # none, all and each one of the bits set, then random records
+        rnd = random.Random(ds_spec.name)
+        yield bytes(ds_spec.dlen)
+        yield b'\xff' * ds_spec.dlen
+        for i in range(8 * ds_spec.dlen):
+            yield (1 << i).to_bytes(ds_spec.dlen, 'little')
+        for i in range(50):
+            yield bytes([rnd.randrange(256) for j in range(ds_spec.dlen)])
+
+    def test_print_one(self):
+        for ds_spec in Specs:
+            decode = pgdb.ds_compile(ds_spec)
+            for data in self.records(ds_spec):
+                self.assertEqual(decode(int.from_bytes(data, 'little')),
+                                 slow_print_one(data, ds_spec),
+                                 '%s %s' % (ds_spec.name, data.hex()))
+
+    def test_print(self):
+        # several records, with their headers
+        for ds_spec in Specs:
+            data = b''.join(self.records(ds_spec))
+            self.assertEqual(pgdb.ds_print(data, ds_spec, 0x1000),
+                             slow_print(data, ds_spec, 0x1000), ds_spec.name)
+
+    def test_known_values(self):
+        # a flat 4G code segment, and IF ZF PF in eflags
+        self.assertEqual(pgdb.ds_print_one(bytes.fromhex('ffff0000009acf00'), pgdb_i386.ds_gdt),
+                         ['00000000  fffff  9a  cf code e/r'])
+        self.assertEqual(pgdb.ds_print_one((0x246).to_bytes(4, 'little'), pgdb_i386.ds_eflags),
+                         [' i z p'])
+        self.assertEqual(pgdb.ds_print(bytes.fromhex('ffff0000009acf00') * 2, pgdb_i386.ds_gdt, 8),
+                         ['008 00000000  fffff  9a  cf code e/r',
+                          '010 00000000  fffff  9a  cf code e/r'])
+
+
+if __name__ == '__main__':
+    unittest.main()
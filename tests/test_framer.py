@@ -0,0 +1,152 @@
+#
+# the GdbClient packet framer: replies split across reads, several in one
+# read, acks and naks, no-ack mode and the receive buffer growing
+
+import unittest
+
+from support import pgdb, packet, PgdbTestCase
+
+
+class FramerTest(PgdbTestCase):
+
+    def queue(self, gdbc, cmd):
+        # a cmd whose future gets the raw reply
+        return gdbc.queue_cmd(cmd, lambda: gdbc.rbuf)
+
+    def test_one_reply(self):
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'qC')
+        self.assertEqual(gdbc.transport.sent, packet('qC'))
+        gdbc.data_received(b'+' + packet('QC01'))
+        self.assertEqual(fut.result(), 'QC01')
+        self.assertEqual(gdbc.transport.sent, packet('qC') + b'+')
+        self.assertEqual(gdbc.rlen, 0)
+
+    def test_split_reply(self):
+        # a partial packet waits at the front of rdata for the rest
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'g')
+        pkt = packet('0123456789abcdef')
+        for i in range(len(pkt)):
+            self.assertFalse(fut.done())
+            gdbc.data_received(pkt[i:i+1])
+        self.assertEqual(fut.result(), '0123456789abcdef')
+        self.assertEqual(gdbc.rlen, 0)
+
+    def test_checksum_split(self):
+        # '#' has arrived but not both checksum digits
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'qC')
+        pkt = packet('QC01')
+        gdbc.data_received(pkt[:-1])
+        self.assertFalse(fut.done())
+        gdbc.data_received(pkt[-1:])
+        self.assertEqual(fut.result(), 'QC01')
+
+    def test_pipelined_replies(self):
+        # replies answer the commands in flight in order, several per read
+        gdbc = self.client()
+        futs = [self.queue(gdbc, 'm%x,4' % (i * 4)) for i in range(4)]
+        self.assertEqual(len(gdbc.inflight), pgdb.Pipeline_depth)
+        gdbc.data_received(b''.join(packet('%08x' % i) for i in range(4)))
+        self.assertEqual([fut.result() for fut in futs],
+                         ['%08x' % i for i in range(4)])
+        self.assertEqual(gdbc.transport.sent.count(b'+'), 4)
+
+    def test_bad_checksum(self):
+        # naked, and the retransmission is what the cmd gets
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'qC')
+        gdbc.transport.sent.clear()
+        gdbc.data_received(b'$QC01#00')
+        self.assertFalse(fut.done())
+        self.assertEqual(gdbc.transport.sent, b'-')
+        self.assertIn('checksum mismatch', ' '.join(self.log.status))
+        gdbc.data_received(packet('QC01'))
+        self.assertEqual(fut.result(), 'QC01')
+        self.assertEqual(gdbc.transport.sent, b'-+')
+
+    def test_checksum_case(self):
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'qC')
+        pkt = packet('QC01')
+        self.assertEqual(pkt[-2:], b'f5')
+        gdbc.data_received(pkt[:-2] + b'F5')
+        self.assertEqual(fut.result(), 'QC01')
+        self.assertEqual(gdbc.transport.sent[-1:], b'+')
+
+    def test_noack(self):
+        gdbc = self.client()
+        fut = gdbc.queue_cmd('QStartNoAckMode')
+        # a barrier, nothing else goes out with it
+        other = self.queue(gdbc, 'qC')
+        self.assertEqual(len(gdbc.inflight), 1)
+        gdbc.data_received(b'+' + packet('OK'))
+        self.assertTrue(fut.done())
+        self.assertTrue(gdbc.noack)
+        self.assertEqual(len(gdbc.inflight), 1)
+        gdbc.transport.sent.clear()
+        # no acks from here on, and a bad checksum can't be naked
+        gdbc.data_received(b'$QC01#00')
+        self.assertEqual(other.result(), 'QC01')
+        self.assertEqual(gdbc.transport.sent, b'')
+
+    def test_noack_refused(self):
+        gdbc = self.client()
+        gdbc.queue_cmd('QStartNoAckMode')
+        gdbc.data_received(packet(''))
+        self.assertFalse(gdbc.noack)
+        self.assertIn('staying in ack mode', self.log.text())
+
+    def test_stray_chars(self):
+        # acks are dropped quietly, anything else is reported
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'qC')
+        gdbc.data_received(b'++xy' + packet('QC01'))
+        self.assertEqual(fut.result(), 'QC01')
+        self.assertEqual(self.log.status, ['++ stray recv chars [xy]'])
+
+    def test_nak(self):
+        gdbc = self.client()
+        self.queue(gdbc, 'qC')
+        gdbc.data_received(b'-')
+        self.assertIn('**** transmission failure ****', self.log.status)
+
+    def test_unexpected_reply(self):
+        # nothing in flight, the reply is just shown
+        gdbc = self.client()
+        gdbc.data_received(packet('OK'))
+        self.assertEqual(self.log.status, ['++ rbuf[OK]'])
+
+    def test_rdata_grows(self):
+        # a reply bigger than the receive buffer, through get_buffer()
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'm0,10000')
+        pkt = packet('ab' * 0x10000)
+        pos = 0
+        while pos < len(pkt):
+            buf = gdbc.get_buffer(-1)
+            self.assertGreaterEqual(len(buf), pgdb.Rbuf_min_free)
+            n = min(len(buf), len(pkt) - pos, 0x3000)
+            buf[:n] = pkt[pos:pos+n]
+            gdbc.buffer_updated(n)
+            pos += n
+        self.assertGreater(len(gdbc.rdata), pgdb.Rbuf_size)
+        self.assertEqual(fut.result(), 'ab' * 0x10000)
+
+    def test_process_read_grows(self):
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'm0,10000')
+        gdbc.data_received(packet('cd' * 0x10000))
+        self.assertEqual(fut.result(), 'cd' * 0x10000)
+
+    def test_escaped_chars(self):
+        # the checksum covers the packet as sent
+        gdbc = self.client()
+        fut = self.queue(gdbc, 'qXfer:features:read:target.xml:0,ffb')
+        gdbc.data_received(packet('l}\x03'))
+        self.assertEqual(fut.result(), 'l}\x03')
+        self.assertEqual(pgdb.rdp_unescape(fut.result()[1:]), '#')
+
+if __name__ == '__main__':
+    unittest.main()
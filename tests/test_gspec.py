@@ -0,0 +1,94 @@
+#
+# 'g' reply decoding through the compiled byte layouts, against the
+# original nibble string reversal
+
+import random
+import unittest
+
+from support import pgdb, use_arch, PgdbTestCase
+
+
+def slow_decode(rbuf, gspec, spec_len):
+    newregs = {}
+    for name, start, end in gspec:
+        if end <= spec_len:
+            try:
+                newregs[name] = int(pgdb.lsn2msn(rbuf[start:end]), 16)
+            except ValueError:
+                pass
+    return newregs
+
+
+class FakeArch(object):
+    def __init__(self, spec):
+        self.spec = spec
+
+
+class GspecTest(PgdbTestCase):
+
+    def replies(self, spec_len):
+        rnd = random.Random(spec_len)
+        yield '0' * spec_len
+        yield 'f' * spec_len
+        for i in range(20):
+            yield ''.join(rnd.choice('0123456789abcdef') for j in range(spec_len))
+
+    def check_arch(self, name):
+        arch = use_arch(name)
+        self.assertEqual(arch.name, name)
+        for spec_len, spec in arch.spec.items():
+            gspec = spec['gspec']
+            if len(gspec) == 0:
+                continue            # filled in from the target description
+            for rbuf in self.replies(spec_len):
+                self.assertEqual(pgdb.gspec_decode(rbuf, spec_len),
+                                 slow_decode(rbuf, gspec, spec_len),
+                                 '%s %d' % (name, spec_len))
+
+    def test_i386(self):
+        self.check_arch('i386')
+
+    def test_arm(self):
+        self.check_arch('arm')
+
+    def test_aarch64(self):
+        self.check_arch('aarch64')
+
+    def test_layout(self):
+        arch = use_arch('i386')
+        layout = pgdb.gspec_layout(1072)
+        self.assertEqual(len(layout), len(arch.spec[1072]['gspec']))
+        self.assertIs(pgdb.gspec_layout(1072), layout)
+
+    def test_odd_nibbles(self):
+        # registers that don't sit on byte boundaries take the slow way
+        gspec = [['a', 0, 3], ['b', 3, 8]]
+        pgdb.Arch = FakeArch({8: {'gspec': gspec}})
+        pgdb.Gspec_layouts.clear()
+        self.assertEqual(pgdb.gspec_layout(8), None)
+        self.assertEqual(pgdb.gspec_decode('12345678', 8),
+                         slow_decode('12345678', gspec, 8))
+
+    def test_little_endian(self):
+        use_arch('i386')
+        rbuf = '0' * 1072
+        rip = [spec for spec in pgdb.Arch.spec[1072]['gspec'] if spec[0] == 'rip'][0]
+        rbuf = rbuf[:rip[1]] + '007c000000000080' + rbuf[rip[2]:]
+        self.assertEqual(pgdb.gspec_decode(rbuf, 1072)['rip'], 0x8000000000007c00)
+
+    def test_unavailable(self):
+        # 'xx' for a register the stub can't read: the rest still decode
+        use_arch('i386')
+        gspec = pgdb.Arch.spec[1072]['gspec']
+        rbuf = list(next(self.replies(1072)))
+        name, start, end = gspec[3]
+        rbuf[start:end] = 'x' * (end - start)
+        rbuf = ''.join(rbuf)
+        newregs = pgdb.gspec_decode(rbuf, 1072)
+        self.assertNotIn(name, newregs)
+        self.assertEqual(newregs, slow_decode(rbuf, gspec, 1072))
+        self.assertEqual(len(newregs), len(gspec) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#
+# -mmap listings: MappedLines reads like the in-memory list of lines, a
+# listing indexes the same either way, and a file changed under its map
+# isn't read again
+
+import os
+import glob
+import tempfile
+import unittest
+
+from support import pgdb, Root, PgdbTestCase
+
+
+class MappedLinesTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        fd, self.fname = tempfile.mkstemp(suffix='.lst')
+        os.close(fd)
+        self.mapped = []
+
+    def tearDown(self):
+        for lines in self.mapped:
+            lines.close()
+        os.unlink(self.fname)
+        PgdbTestCase.tearDown(self)
+
+    def map(self, data):
+        with open(self.fname, 'wb') as fh:
+            fh.write(data)
+        lines = pgdb.MappedLines(self.fname)
+        self.mapped.append(lines)
+        return lines
+
+    def in_memory(self):
+        with open(self.fname, encoding='utf-8', errors='replace') as fh:
+            return [pgdb.src_line(ln) for ln in fh.readlines()]
+
+    def check(self, data):
+        lines = self.map(data)
+        expect = self.in_memory()
+        self.assertEqual(len(lines), len(expect))
+        self.assertEqual(list(lines), expect)
+        self.assertEqual([lines[i] for i in range(-len(lines), 0)], expect)
+        self.assertEqual([ln.decode('utf-8', errors='replace') for ln in lines.raw_lines()], expect)
+
+    def test_lines(self):
+        self.check(b'one\ntwo\n\nfour\n')
+
+    def test_no_trailing_newline(self):
+        self.check(b'one\ntwo')
+        self.check(b'x')
+
+    def test_blank_lines(self):
+        self.check(b'\n')
+        self.check(b'\n\n\n')
+
+    def test_cleanup(self):
+        # tabs, trailing whitespace and crlf as src_line() leaves them
+        self.check(b'\tmov eax, 1   \r\nlabel:\t\tdd 0\t\n  \n')
+
+    def test_not_ascii(self):
+        self.check('café µs\n\xff\n'.encode('utf-8') + b'bad \xff byte\n')
+
+    def test_index(self):
+        lines = self.map(b'a\nb\n')
+        self.assertRaises(IndexError, lambda: lines[2])
+        self.assertRaises(IndexError, lambda: lines[-3])
+
+    def test_changed(self):
+        # assigned lines are kept aside, the file isn't written
+        lines = self.map(b'a\n\n')
+        lines[-1] = '-blank-'
+        self.assertEqual(list(lines), ['a', '-blank-'])
+        with open(self.fname, 'rb') as fh:
+            self.assertEqual(fh.read(), b'a\n\n')
+
+    def test_truncated(self):
+        # reading the map past the end of the file would be a SIGBUS
+        lines = self.map(b'line\n' * 4096)
+        self.assertEqual(lines[4000], 'line')
+        with open(self.fname, 'wb') as fh:
+            fh.write(b'short\n')
+        self.assertEqual(lines[4000], '')
+        self.assertEqual(lines.mm, None)
+        self.assertEqual(list(lines.raw_lines()), [])
+        self.assertIn('changed on disk', self.log.text())
+        # said once
+        lines[0]
+        self.assertEqual(self.log.text().count('changed on disk'), 1)
+
+    def test_rewritten(self):
+        # same size, new contents: the mtime gives it away
+        lines = self.map(b'old\n')
+        st = os.stat(self.fname)
+        with open(self.fname, 'r+b') as fh:
+            fh.write(b'new\n')
+        os.utime(self.fname, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+        self.assertEqual(lines[0], '')
+
+    def test_close(self):
+        lines = self.map(b'a\nb\n')
+        lines.close()
+        lines.close()
+        self.assertEqual(lines[1], '')
+        self.assertEqual(len(lines), 2)
+
+
+class ListingIndexTest(PgdbTestCase):
+    # every example listing indexes the same mapped or in memory
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        pgdb.Active_src = object()      # no window to center, no curses
+        self.saved_mmap = pgdb.Mmap_listings
+
+    def tearDown(self):
+        for src in pgdb.Srcs:
+            src.close()
+        pgdb.Mmap_listings = self.saved_mmap
+        pgdb.Active_src = None
+        PgdbTestCase.tearDown(self)
+
+    def load(self, fname, ftype, mmap):
+        pgdb.Mmap_listings = mmap
+        src = pgdb.Src(fname, ftype)
+        self.assertEqual(isinstance(src.lines, pgdb.MappedLines), mmap)
+        return (src.ftype, src.offset, src.segments, src.maxx, list(src.lines),
+                src.codesyms, src.datasyms,
+                list(src.ip_addrs), list(src.ip_lines), list(src.nip_lines),
+                src.nip_addrs, list(src.label_lines), src.label_names, src.labels)
+
+    def test_examples(self):
+        fnames = sorted(glob.glob(os.path.join(Root, 'examples', '**', '*.lst'),
+                                  recursive=True))
+        self.assertGreater(len(fnames), 0)
+        for fname in fnames:
+            ftype = 'nasmlst' if os.path.basename(fname).startswith('oz_') else None
+            self.assertEqual(self.load(fname, ftype, True),
+                             self.load(fname, ftype, False), fname)
+
+
+if __name__ == '__main__':
+    unittest.main()
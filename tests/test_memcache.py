@@ -0,0 +1,98 @@
+#
+# MemCache: pages holding all or part of their bytes, and the epoch
+
+import unittest
+
+from support import pgdb, PgdbTestCase
+
+Page = pgdb.Mem_page_size
+
+
+class MemCacheTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        self.cache = pgdb.MemCache()
+
+    def read(self, start, end, data=None):
+        # a finished read of [start, end)
+        fut = self.loop.create_future()
+        if data == None:
+            data = bytes([a % 256 for a in range(start, end)])
+        fut.set_result(data)
+        self.cache.fill(start, end, fut, self.cache.epoch)
+        return fut
+
+    def test_empty(self):
+        self.assertEqual(self.cache.lookup(0, 4), None)
+        self.assertFalse(self.cache.covers(0, 0, 4))
+        self.assertEqual(self.cache.lookup(0, 0), b'')
+
+    def test_whole_pages(self):
+        self.read(Page, 3 * Page, bytes(2 * Page))
+        self.assertEqual(sorted(self.cache.pages), [Page, 2 * Page])
+        self.assertEqual(self.cache.lookup(Page + 0x10, Page), bytes(Page))
+        self.assertTrue(self.cache.covers(2 * Page, 2 * Page, 3 * Page))
+        self.assertEqual(self.cache.lookup(Page, 2 * Page + 1), None)
+
+    def test_partial_page(self):
+        # only what was read is cached
+        self.read(0x10, 0x20)
+        self.assertEqual(self.cache.pages[0], (0x10, bytes(range(0x10, 0x20))))
+        self.assertEqual(self.cache.lookup(0x18, 4), bytes(range(0x18, 0x1c)))
+        self.assertEqual(self.cache.lookup(0x0f, 4), None)
+        self.assertEqual(self.cache.lookup(0x1e, 4), None)
+        self.assertTrue(self.cache.covers(0, 0x10, 0x20))
+        self.assertFalse(self.cache.covers(0, 0x10, 0x21))
+
+    def test_merge(self):
+        # pieces that touch or overlap become one
+        self.read(0x10, 0x20)
+        self.read(0x20, 0x30)
+        self.read(0x08, 0x14)
+        self.assertEqual(self.cache.pages[0], (0x08, bytes(range(0x08, 0x30))))
+        # a gap is not bridged, the new piece replaces the old
+        self.read(0x40, 0x50)
+        self.assertEqual(self.cache.pages[0], (0x40, bytes(range(0x40, 0x50))))
+
+    def test_fetching(self):
+        # a read on its way covers its range, and is dropped once it's in
+        fut = self.loop.create_future()
+        self.cache.fetching[0] = (0x10, 0x20, fut)
+        self.assertTrue(self.cache.covers(0, 0x14, 0x18))
+        self.assertFalse(self.cache.covers(0, 0x14, 0x24))
+        fut.set_result(bytes(0x10))
+        self.cache.fill(0x10, 0x20, fut, self.cache.epoch)
+        self.assertEqual(self.cache.fetching, {})
+        self.assertEqual(self.cache.lookup(0x10, 0x10), bytes(0x10))
+
+    def test_error(self):
+        # an error reply isn't cached
+        fut = self.loop.create_future()
+        self.cache.fetching[0] = (0, 0x10, fut)
+        fut.set_result('E14')
+        self.cache.fill(0, 0x10, fut, self.cache.epoch)
+        self.assertEqual(self.cache.fetching, {})
+        self.assertEqual(self.cache.pages, {})
+
+    def test_short(self):
+        # nor is a reply of the wrong length
+        self.read(0, 0x10, bytes(8))
+        self.assertEqual(self.cache.pages, {})
+
+    def test_invalidate(self):
+        self.read(0, Page)
+        fut = self.loop.create_future()
+        self.cache.fetching[Page] = (Page, 2 * Page, fut)
+        epoch = self.cache.epoch
+        self.cache.invalidate()
+        self.assertEqual(self.cache.lookup(0, 1), None)
+        self.assertFalse(self.cache.covers(Page, Page, Page + 1))
+        # a read from before the invalidate stays out of the cache
+        fut.set_result(bytes(Page))
+        self.cache.fill(Page, 2 * Page, fut, epoch)
+        self.assertEqual(self.cache.pages, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
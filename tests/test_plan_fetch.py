@@ -0,0 +1,100 @@
+#
+# planning the memory window reads: clamped to the windows, joined where
+# they touch, and the cache and in-flight reads used before the target
+
+import unittest
+
+from support import pgdb, PgdbTestCase
+
+Page = pgdb.Mem_page_size
+Readable = 0x800        # the fake target has memory below this
+
+
+class PlanFetchTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        self.gdbc = self.client()
+        self.gdbc.fetch_mem = self.fetch_mem
+        self.fetches = []
+
+    def fetch_mem(self, addr, length):
+        # stands in for the m cmds, answered on the next loop pass
+        self.fetches.append((addr, length))
+        fut = self.loop.create_future()
+        if addr + length > Readable:
+            data = 'E14'
+        else:
+            data = bytes([a % 256 for a in range(addr, addr + length)])
+        self.loop.call_soon(fut.set_result, data)
+        return fut
+
+    def read(self, addr, length):
+        return self.loop.run_until_complete(self.gdbc.read_cached(addr, length))
+
+    def expect(self, addr, length):
+        return bytes([a % 256 for a in range(addr, addr + length)])
+
+    def test_clamped(self):
+        # only the window is read, not the rest of its pages
+        self.assertEqual(self.read(0x7f0, 0x10), self.expect(0x7f0, 0x10))
+        self.assertEqual(self.fetches, [(0x7f0, 0x10)])
+
+    def test_across_pages(self):
+        self.assertEqual(self.read(Page - 0x10, 0x20), self.expect(Page - 0x10, 0x20))
+        self.assertEqual(self.fetches, [(Page - 0x10, 0x20)])
+
+    def test_touching_windows(self):
+        # windows that overlap or touch are one read
+        self.gdbc.plan_fetch([(0x10, 0x20), (0x30, 0x10), (0x38, Page)])
+        self.assertEqual(self.fetches, [(0x10, Page + 0x28)])
+
+    def test_separate_windows(self):
+        self.gdbc.plan_fetch([(0x10, 0x10), (2 * Page + 0x10, 0x10)])
+        self.assertEqual(self.fetches, [(0x10, 0x10), (2 * Page + 0x10, 0x10)])
+
+    def test_gap_in_a_page(self):
+        # the bytes between two windows in one page are read too
+        self.gdbc.plan_fetch([(0x10, 0x10), (0x80, 0x10)])
+        self.assertEqual(self.fetches, [(0x10, 0x80)])
+
+    def test_cached(self):
+        self.read(0x100, 0x40)
+        self.assertEqual(self.read(0x110, 0x10), self.expect(0x110, 0x10))
+        self.assertEqual(self.fetches, [(0x100, 0x40)])
+        # partly cached, the whole window is read again
+        self.assertEqual(self.read(0x120, 0x40), self.expect(0x120, 0x40))
+        self.assertEqual(self.fetches, [(0x100, 0x40), (0x120, 0x40)])
+
+    def test_in_flight(self):
+        # a read on its way is waited on, not repeated
+        self.gdbc.plan_fetch([(0x100, 0x40)])
+        self.assertEqual(self.read(0x110, 0x10), self.expect(0x110, 0x10))
+        self.assertEqual(self.fetches, [(0x100, 0x40)])
+
+    def test_invalidated(self):
+        self.read(0x100, 0x40)
+        self.gdbc.memcache.invalidate()
+        self.read(0x100, 0x40)
+        self.assertEqual(self.fetches, [(0x100, 0x40), (0x100, 0x40)])
+
+    def test_error_in_window(self):
+        # the window itself can't be read: that's the answer, no retry
+        self.assertEqual(self.read(Readable - 0x10, 0x20), 'E14')
+        self.assertEqual(self.fetches, [(Readable - 0x10, 0x20)])
+
+    def test_error_next_door(self):
+        # a read joined with an unreadable neighbour failed: read exactly
+        # the window again
+        self.gdbc.plan_fetch([(Readable - 0x20, 0x10), (Readable - 0x10, 0x20)])
+        self.assertEqual(self.fetches, [(Readable - 0x20, 0x30)])
+        self.assertEqual(self.read(Readable - 0x20, 0x10), self.expect(Readable - 0x20, 0x10))
+        self.assertEqual(self.fetches, [(Readable - 0x20, 0x30), (Readable - 0x20, 0x10)])
+
+    def test_zero_length(self):
+        self.assertEqual(self.read(0x100, 0), b'')
+        self.assertEqual(self.fetches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
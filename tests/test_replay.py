@@ -0,0 +1,112 @@
+#
+# -record session files and -replay
+
+import os
+import asyncio
+import tempfile
+import unittest
+
+from support import pgdb, packet, PgdbTestCase
+
+
+class FakeClient(object):
+    # what ReplayTransport hands received bytes to
+    def __init__(self):
+        self.received = []
+
+    def data_received(self, data):
+        self.received.append(bytes(data))
+
+
+class ReplayTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        fd, self.fname = tempfile.mkstemp(suffix='.session')
+        os.close(fd)
+
+    def tearDown(self):
+        pgdb.Session = None
+        os.unlink(self.fname)
+        PgdbTestCase.tearDown(self)
+
+    def record(self, records):
+        session = pgdb.SessionRecorder(self.fname)
+        for kind, data in records:
+            session.record(kind, data)
+        session.close()
+
+    def run_loop(self, secs=0.05):
+        self.loop.run_until_complete(asyncio.sleep(secs))
+
+    def test_read_session(self):
+        # binary data, newlines included, comes back as recorded
+        records = [(b's', packet('g')), (b'r', b'+\n$\x00\xff#00\n'),
+                   (b'k', b'105'), (b'r', b'')]
+        self.record(records)
+        got = pgdb.read_session(self.fname)
+        self.assertEqual([(kind, data) for secs, kind, data in got], records)
+        secs = [secs for secs, kind, data in got]
+        self.assertEqual(secs, sorted(secs))
+
+    def test_not_a_session(self):
+        with open(self.fname, 'wb') as fh:
+            fh.write(b'something else\n')
+        self.assertRaises(Exception, pgdb.read_session, self.fname)
+
+    def test_replay_in_order(self):
+        # received bytes wait for what was sent before them, keys come
+        # a moment after the traffic before them
+        self.record([(b'r', b'$hello#00'),
+                     (b's', b'$g#67'),
+                     (b'r', b'$regs#00'),
+                     (b'k', b'113'),
+                     (b'r', b'$after#00')])
+        client = FakeClient()
+        keys = []
+        rt = pgdb.ReplayTransport(client, self.fname, keys.append)
+        self.run_loop()
+        self.assertEqual(client.received, [b'$hello#00'])
+        rt.write(b'$g')
+        self.run_loop()
+        self.assertEqual(client.received, [b'$hello#00'])
+        rt.write(b'#67')
+        self.run_loop()
+        self.assertEqual(client.received, [b'$hello#00', b'$regs#00', b'$after#00'])
+        self.assertEqual(keys, [113])
+        self.assertFalse(rt.diverged)
+        self.assertIn('replay done', self.log.text())
+
+    def test_divergence(self):
+        self.record([(b's', b'$g#67'), (b'r', b'$regs#00')])
+        client = FakeClient()
+        rt = pgdb.ReplayTransport(client, self.fname, None)
+        rt.write(b'$?#3f')
+        self.run_loop()
+        self.assertTrue(rt.diverged)
+        self.assertIn('replay diverged at sent byte 0', self.log.text())
+        # the replay carries on regardless
+        self.assertEqual(client.received, [b'$regs#00'])
+
+    def test_record_then_replay(self):
+        # a GdbClient session recorded through the transport, then played
+        # back to a new GdbClient
+        pgdb.Session = pgdb.SessionRecorder(self.fname)
+        gdbc = self.client()
+        fut = gdbc.queue_cmd('m100,4', lambda: gdbc.rbuf)
+        gdbc.data_received(b'+' + packet('deadbeef'))
+        self.assertEqual(fut.result(), 'deadbeef')
+        pgdb.Session.close()
+        pgdb.Session = None
+
+        gdbc = pgdb.GdbClient()
+        gdbc.cmds = []
+        gdbc.connection_made(pgdb.ReplayTransport(gdbc, self.fname, None))
+        fut = gdbc.queue_cmd('m100,4', lambda: gdbc.rbuf)
+        self.run_loop()
+        self.assertEqual(fut.result(), 'deadbeef')
+        self.assertFalse(gdbc.transport.diverged)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#
+# which listings cover an address (SrcRanges) and which one of those gets
+# the source window (pick_src)
+
+import random
+import unittest
+
+from support import pgdb, PgdbTestCase
+
+
+class FakeSrc(object):
+    # enough of a Src for SrcRanges and pick_src: code ranges from a map
+    # file or the span of ip_addrs, and the addresses that have a line
+    code_ranges = pgdb.Src.code_ranges
+
+    def __init__(self, name, segments, ranges=None, ip_addrs=None, offset=0):
+        self.name = name
+        self.segments = segments
+        self.ranges = ranges or []
+        self.ip_addrs = ip_addrs or []
+        self.offset = offset
+        self.listed = set()
+        self.codesyms = []
+        self.datasyms = []
+
+    def lists_ip(self, ip):
+        return ip in self.listed
+
+    def __repr__(self):
+        return self.name
+
+
+def slow_lookup(seg, ip):
+    return [src for src in pgdb.Srcs
+                if len(src.ip_addrs) > 0 and seg in (src.segments or [])
+                and any(s <= ip < e for s, e in src.code_ranges())]
+
+
+class SrcRangesTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        self.ranges = pgdb.SrcRanges()
+
+    def random_srcs(self, seed, n):
+        rnd = random.Random(seed)
+        for i in range(n):
+            segs = rnd.choice([[0], [0x10], [0, 0x10], None])
+            offset = rnd.randrange(0x100)
+            if rnd.randrange(3):
+                # a map file, several (maybe overlapping, maybe empty) ranges
+                ranges = []
+                for j in range(rnd.randrange(1, 4)):
+                    start = rnd.randrange(0x400)
+                    ranges.append((start, start + rnd.randrange(0x100)))
+                src = FakeSrc('src%d' % i, segs, ranges, [0], offset)
+            else:
+                ips = sorted(rnd.sample(range(0x300), rnd.randrange(0, 4)))
+                src = FakeSrc('src%d' % i, segs, None, ips, offset)
+            pgdb.Srcs.append(src)
+
+    def check(self):
+        for seg in [0, 0x10, 0x20]:
+            for ip in range(0, 0x520):
+                self.assertEqual(self.ranges.lookup(seg, ip), slow_lookup(seg, ip),
+                                 '%x:%x' % (seg, ip))
+
+    def test_against_walk(self):
+        for seed in range(5):
+            pgdb.Srcs[:] = []
+            self.random_srcs(seed, 8)
+            self.check()
+
+    def test_refresh(self):
+        self.random_srcs(1, 4)
+        self.check()
+        pgdb.Srcs[0].ranges.append((0x500, 0x510))
+        pgdb.Srcs[0].segments = [0]
+        self.check()
+        self.random_srcs(2, 3)
+        self.check()
+        del pgdb.Srcs[1]
+        self.check()
+
+    def test_no_srcs(self):
+        self.assertEqual(self.ranges.lookup(0, 0x7c00), [])
+
+
+class PickSrcTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        pgdb.Active_src = None
+        pgdb.Recent_src = []
+        pgdb.Symbols = pgdb.SymTable()
+        pgdb.Src_ranges = pgdb.SrcRanges()
+        self.a = FakeSrc('a', [0], [(0x100, 0x200)], [0])
+        self.b = FakeSrc('b', [0], [(0x180, 0x200)], [0])
+        self.c = FakeSrc('c', [0], [(0x000, 0x300)], [0])
+        pgdb.Srcs[:] = [self.a, self.b, self.c]
+
+    def pick(self, ip):
+        return pgdb.pick_src(pgdb.Src_ranges.lookup(0, ip), 0, ip)
+
+    def test_one(self):
+        self.assertEqual(pgdb.pick_src([], 0, 0x10), None)
+        self.assertEqual(self.pick(0x10), self.c)
+
+    def test_nearest_range(self):
+        # nothing else to go on, the range starting nearest below ip
+        self.assertEqual(self.pick(0x190), self.b)
+        self.assertEqual(self.pick(0x150), self.a)
+
+    def test_listed_first(self):
+        # a file with a line at ip beats everything else
+        self.c.listed.add(0x190)
+        pgdb.Active_src = self.b
+        pgdb.Recent_src = [self.a]
+        self.assertEqual(self.pick(0x190), self.c)
+        self.a.listed.add(0x190)
+        self.assertEqual(self.pick(0x190), self.a)
+
+    def test_label(self):
+        # then a file with a label at ip
+        self.c.codesyms.append(('entry', 0x190, [0], 0))
+        self.assertEqual(self.pick(0x190), self.c)
+        self.assertEqual(self.pick(0x191), self.b)
+
+    def test_active_then_recent(self):
+        pgdb.Recent_src = [self.c, self.a]
+        self.assertEqual(self.pick(0x190), self.c)
+        pgdb.Active_src = self.a
+        self.assertEqual(self.pick(0x190), self.a)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#
+# pgdb against pgdb_stub.py, both in this process: step, 'g' and 'm'
+# over a real tcp connection
+
+import asyncio
+import unittest
+
+from support import pgdb, use_arch, PgdbTestCase
+import pgdb_stub
+
+Code = 0x7c00
+
+
+class StubTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        pgdb_stub.log = lambda s: None
+        use_arch('i386')
+        self.target = pgdb_stub.Target('i386', 2, Code)
+        self.target.load(0, bytes(0x10000))
+        self.code = bytes(range(256)) * 3
+        self.target.load(Code, self.code)
+        self.server = self.loop.run_until_complete(self.loop.create_server(
+                        lambda: pgdb_stub.StubServer(self.target, 0, False, False),
+                        '127.0.0.1', 0))
+        port = self.server.sockets[0].getsockname()[1]
+        self.gdbc = pgdb.GdbClient()
+        self.gdbc.cmds = []             # no startup sequence
+        self.loop.run_until_complete(self.loop.create_connection(
+                        lambda: self.gdbc, '127.0.0.1', port))
+
+    def tearDown(self):
+        self.gdbc.transport.close()
+        self.server.close()
+        self.wait(self.server.wait_closed())
+        self.wait(asyncio.sleep(0.01))
+        PgdbTestCase.tearDown(self)
+
+    def wait(self, fut):
+        return self.loop.run_until_complete(asyncio.wait_for(fut, 5))
+
+    def cmd(self, cmd):
+        # the raw reply to cmd
+        return self.wait(self.gdbc.queue_cmd(cmd, lambda: self.gdbc.rbuf))
+
+    def regs(self):
+        rbuf = self.cmd('g')
+        self.assertIn(len(rbuf), pgdb.Arch.spec)
+        return pgdb.gspec_decode(rbuf, len(rbuf))
+
+    def mreads(self):
+        return self.gdbc.stats['m'].n if 'm' in self.gdbc.stats else 0
+
+    def test_noack(self):
+        self.assertEqual(self.wait(self.gdbc.queue_cmd('QStartNoAckMode')), 'OK')
+        self.assertTrue(self.gdbc.noack)
+        self.assertEqual(self.regs()['rip'], Code)
+
+    def test_step(self):
+        regs = self.regs()
+        self.assertEqual(regs['rip'], Code)
+        self.assertEqual(regs['eflags'], 0x2)
+        reply = self.cmd('vCont;s:01')
+        self.assertTrue(reply.startswith('T05thread:01;'), reply)
+        self.assertEqual(self.regs()['rip'], Code + 1)
+        # the other cpu didn't move
+        self.assertEqual(self.cmd('Hg02'), 'OK')
+        self.assertEqual(self.regs()['rip'], Code)
+
+    def test_p(self):
+        rip = pgdb.gspec_regnums(pgdb.Arch.spec[1072]['gspec'])['rip']
+        self.assertEqual(self.cmd('p%x' % rip), Code.to_bytes(8, 'little').hex())
+
+    def test_mem(self):
+        # a window bigger than a packet is read in chunks
+        self.gdbc.packet_size = 0x100
+        self.assertEqual(self.wait(self.gdbc.read_mem(Code, len(self.code))), self.code)
+        n = self.mreads()
+        self.assertEqual(n, -(-len(self.code) // ((0x100 - 8) // 2)))
+        # then from the cache, until the target runs
+        self.assertEqual(self.wait(self.gdbc.read_mem(Code + 0x80, 0x10)),
+                         self.code[0x80:0x90])
+        self.assertEqual(self.mreads(), n)
+        self.cmd('vCont;s:01')
+        self.assertEqual(self.wait(self.gdbc.read_mem(Code + 0x80, 0x10)),
+                         self.code[0x80:0x90])
+        self.assertEqual(self.mreads(), n + 1)
+
+    def test_mem_callback(self):
+        got = []
+        fut = self.gdbc.read_mem(Code, 4, lambda data, length: got.append((data, length)))
+        self.wait(fut)
+        self.wait(asyncio.sleep(0))
+        self.assertEqual(got, [(self.code[:4], 4)])
+
+    def test_mem_errors(self):
+        # unreadable memory is the stub's error reply
+        self.assertEqual(self.wait(self.gdbc.read_mem(0x20000, 0x10)), 'E14')
+        self.assertEqual(self.wait(self.gdbc.read_mem(0xfff8, 0x10)), 'E14')
+        self.assertEqual(self.wait(self.gdbc.read_mem(Code, 0)), b'')
+        # and doesn't get in the way of what can be read
+        self.assertEqual(self.wait(self.gdbc.read_mem(0xfff0, 0x10)), bytes(0x10))
+
+    def test_pipelined(self):
+        # register and memory reads interleaved, all in flight together
+        futs = [self.gdbc.read_mem(Code + i * 0x100, 0x100) for i in range(3)]
+        g = self.gdbc.queue_cmd('g', lambda: self.gdbc.rbuf)
+        self.assertEqual([self.wait(fut) for fut in futs],
+                         [self.code[i*0x100:(i+1)*0x100] for i in range(3)])
+        self.assertEqual(len(self.wait(g)), 1072)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#
+# the symbol index against a walk over every symbol of every listing
+
+import random
+import unittest
+
+from support import pgdb, PgdbTestCase
+
+
+class FakeSrc(object):
+    # just the symbol tables of a listing, (name, offset, segments, fixup)
+    def __init__(self, name):
+        self.name = name
+        self.codesyms = []
+        self.datasyms = []
+
+    def __repr__(self):
+        return self.name
+
+
+def slow_below(ip, seg, src, kind):
+    best = None
+    for s in pgdb.Srcs:
+        for sym in s.codesyms if kind == 'code' else s.datasyms:
+            if src != None and s != src:
+                continue
+            if seg != None and not seg in (sym[2] or []):
+                continue
+            if sym[1] <= ip and (best == None or sym[1] >= best[0][1]):
+                best = (sym, s)
+    return best
+
+def slow_lookup(name, src, kind):
+    for s in pgdb.Srcs:
+        for sym in s.codesyms if kind == 'code' else s.datasyms:
+            if sym[0] == name and (src == None or s == src):
+                return sym, s
+    return None
+
+
+class SymTableTest(PgdbTestCase):
+
+    def setUp(self):
+        PgdbTestCase.setUp(self)
+        rnd = random.Random(22)
+        for i in range(3):
+            src = FakeSrc('src%d' % i)
+            for table in [src.codesyms, src.datasyms]:
+                for j in range(40):
+                    segs = rnd.choice([None, [0x7c0], [0x10], [0x10, 0x7c0]])
+                    table.append(('sym%d' % rnd.randrange(30), rnd.randrange(0x400),
+                                  segs, rnd.randrange(0x400)))
+            pgdb.Srcs.append(src)
+        self.symbols = pgdb.SymTable()
+
+    def check(self):
+        for kind in ['code', 'data']:
+            for src in [None] + pgdb.Srcs:
+                for seg in [None, 0x10, 0x7c0, 0x99]:
+                    for ip in range(-1, 0x410, 7):
+                        self.assertEqual(self.symbols.below(ip, seg, src, kind),
+                                         slow_below(ip, seg, src, kind),
+                                         '%s %s %s %x' % (kind, src, seg, ip))
+                for i in range(32):
+                    name = 'sym%d' % i
+                    self.assertEqual(self.symbols.lookup(name, src, kind),
+                                     slow_lookup(name, src, kind))
+
+    def test_against_walk(self):
+        self.check()
+
+    def test_refresh(self):
+        # symbols loaded later are seen at the next lookup
+        self.check()
+        src = pgdb.Srcs[1]
+        src.codesyms.append(('late', 0x3ff, [0x10], 0))
+        self.assertEqual(self.symbols.below(0x3ff, 0x10, src, 'code'),
+                         (src.codesyms[-1], src))
+        self.assertEqual(self.symbols.lookup('late'), (src.codesyms[-1], src))
+        new = FakeSrc('src3')
+        new.datasyms.append(('sym1', 0, None, 0))
+        pgdb.Srcs.append(new)
+        self.check()
+
+    def test_ties(self):
+        # the last symbol loaded at an offset wins, the first by name
+        pgdb.Srcs[:] = [FakeSrc('a'), FakeSrc('b')]
+        pgdb.Srcs[0].codesyms.append(('x', 0x100, None, 1))
+        pgdb.Srcs[1].codesyms.append(('x', 0x100, None, 2))
+        self.assertEqual(self.symbols.below(0x100)[1], pgdb.Srcs[1])
+        self.assertEqual(self.symbols.lookup('x')[1], pgdb.Srcs[0])
+        self.assertEqual(self.symbols.below(0xff), None)
+        self.assertEqual(self.symbols.lookup('y'), None)
+        self.assertEqual(self.symbols.below(0x100, kind='data'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()